@@ -0,0 +1,76 @@
+'''
+OBJECTIVE OF THIS FILE:-
+
+THIS CODE BENCHMARKS THE DOWNLOAD STAGE AGAINST THE LOCAL MIRROR OF mirror_server.py, REPORTING THE TIME OF fetch_URL, select_files AND fetch_files ALONG WITH THE THROUGHPUT AND TAIL LATENCY OF THE DOWNLOADS.
+THE LATENCY, BANDWIDTH AND ERROR RATES OF THE MIRROR ARE SET BELOW SO THAT RUNS ARE REPRODUCIBLE WITHOUT NETWORK.
+INPUT: Local mirror (started by this code)
+OUTPUT: Printed report
+'''
+
+# Importing libraries
+import os, sys, tempfile, threading, time
+import numpy as np
+from download import Downloader
+from mirror_server import make_server
+
+SETTINGS = {
+    'n_stations': 500, # Number of stations listed by the mirror
+    'hours_per_day': 24, # Hourly observations per day of the synthetic files
+    'latency': 0.05, # Mean latency in seconds of each response
+    'bandwidth': 20*1024*1024, # Bytes per second of each response
+    'error_rate': 0.02, # Fraction of requests answered with 503
+    'throttle_rate': 0.01 # Fraction of requests answered with 429
+}
+
+def run(year=2002, n_locs=20, seed=42, max_concurrency=8, settings=SETTINGS):
+    '''
+    Function:- Starts the mirror, downloads the selected files of a year from it into a temporary directory and prints the report
+
+    Inputs:-
+    year [int]: Year
+    n_locs [int]: Number of files to be downloaded
+    seed [int]: Seed of the selection of stations
+    max_concurrency [int]: Maximum number of parallel downloads
+    settings [dict]: Settings of the mirror
+
+    Output:-
+    report [dict]: Times in seconds of each step, throughput and latency percentiles
+    '''
+    server = make_server(port=0, archive_dir=os.devnull, seed=seed, cache_size=max(64, n_locs), **settings) # No archive so that every file is synthetic
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_address[1]}/'
+    downloader = Downloader(backoff=0.1, max_concurrency=max_concurrency)
+    report = {}
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        response, year_url = downloader.fetch_URL(downloader.basic_info(base_url), year)
+        report['fetch_URL (s)'] = time.perf_counter() - start
+        start = time.perf_counter()
+        indices, csv_links = downloader.select_files(response, year, 'specific', n_locs, manifest_dir=os.path.join(directory, 'Selections'))
+        report['select_files (s)'] = time.perf_counter() - start
+        for idx in indices: # Files are generated before the measurement so that only serving them is timed
+            server.RequestHandlerClass.data.file(year, csv_links[idx])
+        downloader.latencies.clear()
+        start = time.perf_counter()
+        failed = downloader.fetch_files(directory, indices, csv_links, year_url, year)
+        report['fetch_files (s)'] = time.perf_counter() - start
+        folder = os.path.join(directory, str(year))
+        size = sum(os.path.getsize(os.path.join(folder, f)) for f in os.listdir(folder))/(1024*1024)
+    server.shutdown()
+    latencies = np.array(downloader.latencies)
+    report['files'] = len(indices) - len(failed)
+    report['throughput (files/s)'] = report['files']/report['fetch_files (s)']
+    report['throughput (MB/s)'] = size/report['fetch_files (s)']
+    for q in [50, 95, 99]:
+        report[f'latency p{q} (s)'] = float(np.percentile(latencies, q)) if len(latencies) else float('nan')
+    print("\nBenchmark of the download stage")
+    for key, value in report.items():
+        print(f"{key:<24} {value:>10.3f}" if isinstance(value, float) else f"{key:<24} {value:>10}")
+    return report
+
+# MAIN CODE
+if __name__ == '__main__':
+    # Optional arguments: number of files and maximum number of parallel downloads e.g. python benchmark_download.py 50 16
+    n_locs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    max_concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    run(n_locs=n_locs, max_concurrency=max_concurrency)
@@ -0,0 +1,155 @@
+'''
+OBJECTIVE OF THIS FILE:-
+
+THIS CODE STORES THE MONTHLY AVERAGES OF A YEAR AS A SINGLE MEMORY-MAPPED ARRAY OF SHAPE (STATIONS x 12 MONTHS x 5 PARAMETERS x {COMPUTED, GROUND TRUTH, COMPUTED WITHOUT SUSPECT DATA}).
+THE DAILY AVERAGES ARE STORED THE SAME WAY IN A SECOND ARRAY WITH 366 DAYS INSTEAD OF 12 MONTHS.
+process.py FILLS THE COMPUTED VALUES, prepare.py FILLS THE GROUND TRUTHS AND evaluate.py READS THE PAIRS AS VECTORIZED SLICES.
+OUTPUT DIR: Cube
+'''
+
+# Importing libraries
+import os
+import numpy as np
+
+PARAMS = [
+    'Dew Point Temperature',
+    'Relative Humidity',
+    'Sea Level Pressure',
+    'Station Pressure',
+    'Wet Bulb Temperature'
+] # Parameters in the order of the computed columns of process.py
+COMPUTED, GT, NO_SUSPECT = 0, 1, 2 # Indices of the last axis of the cube, NO_SUSPECT holds the computed values without the suspect hourly values
+KINDS = 3 # Length of the last axis of the cube
+PERIODS = {'monthly': 12, 'daily': 366} # Number of periods (months or days of the year) for each granularity
+
+class Aggregate_Cube(): # Class for the memory-mapped cube of monthly (or daily) averages of a year
+    def __init__(self, year, stations=None, directory='Cube', mode='r+', granularity='monthly', keep=(GT,)) -> None:
+        '''
+        Function:- Creates a new cube for the given stations or opens the existing cube of a year
+
+        Inputs:-
+        self [object]: Instance of the current object
+        year [int]: Year
+        stations [list]: Station numbers (filenames without '.csv'). If given, a new cube filled with NaN is created, replacing an existing one except for the kinds in keep
+        directory [str]: Directory in which the cubes of all years are stored
+        mode [str]: Mode in which an existing cube is opened, 'r' for reading and 'r+' for updating
+        granularity [str]: 'monthly' or 'daily'
+        keep [tuple]: Kinds of values of the stations of an existing cube which are copied to the new cube, e.g. the ground truths of prepare.py when only process.py is re-run
+
+        Output:- None
+        '''
+        folder = os.path.join(directory, str(year))
+        path = Aggregate_Cube.cube_path(year, directory, granularity) # Array with a .npy header so that shape and dtype are stored with it
+        index_path = os.path.join(folder, 'stations.txt') # Station numbers in the order of the first axis
+        if stations is not None:
+            os.makedirs(folder, exist_ok=True)
+            stations = [str(station) for station in stations]
+            kept = self.read_kept(path, index_path, stations, keep) # Read before the file is replaced
+            cube = np.lib.format.open_memmap(path, mode='w+', dtype=np.float64, shape=(len(stations), PERIODS[granularity], len(PARAMS), KINDS))
+            cube[:] = np.nan
+            for kind, (rows, values) in kept.items():
+                cube[rows, ..., kind] = values
+            with open(index_path, 'w') as f:
+                f.write('\n'.join(stations))
+            print(f"Created cube of shape {cube.shape} at {path}")
+        else:
+            cube = np.load(path, mmap_mode=mode)
+            with open(index_path) as f:
+                stations = f.read().split()
+        self.cube = cube
+        self.stations = stations
+        self.index = {station: i for i, station in enumerate(stations)} # Station number to position on the first axis
+        self.path = path
+        self.year = year
+        self.granularity = granularity
+
+    @staticmethod
+    def read_kept(path, index_path, stations, keep):
+        '''
+        Function:- Reads the values of the given kinds of the stations of an existing cube which are also in the new list of stations
+
+        Output:-
+        kept [dict]: Kind as key and (positions of the stations in the new cube, values) as value. Empty if there is no existing cube
+        '''
+        if not keep or not os.path.isfile(path) or not os.path.isfile(index_path):
+            return {}
+        old = np.load(path, mmap_mode='r')
+        with open(index_path) as f:
+            old_index = {station: i for i, station in enumerate(f.read().split())}
+        common = [(new, old_index[station]) for new, station in enumerate(stations) if station in old_index]
+        if not common or old.shape[0] != len(old_index):
+            return {}
+        rows, old_rows = (list(positions) for positions in zip(*common))
+        return {kind: (rows, np.array(old[old_rows, ..., kind])) for kind in keep}
+
+    def stations_without(self, kind):
+        '''
+        Function:- Finds the stations which have computed values but no value of a kind (e.g. GT), i.e. whose values of that kind have not been stored yet
+        '''
+        computed = np.isfinite(self.cube[..., COMPUTED]).any(axis=(1, 2))
+        stored = np.isfinite(self.cube[..., kind]).any(axis=(1, 2))
+        return [self.stations[i] for i in np.flatnonzero(computed & ~stored)]
+
+    @staticmethod
+    def cube_path(year, directory='Cube', granularity='monthly'):
+        '''
+        Function:- Returns the path of the cube of a year for a given granularity
+        '''
+        filename = 'cube.npy' if granularity == 'monthly' else f'cube_{granularity}.npy'
+        return os.path.join(directory, str(year), filename)
+
+    @staticmethod
+    def exists(year, directory='Cube', granularity='monthly'):
+        '''
+        Function:- Checks if the cube of a year has been created
+        '''
+        return os.path.isfile(Aggregate_Cube.cube_path(year, directory, granularity))
+
+    def store(self, station, param, kind, values):
+        '''
+        Function:- Stores the values of a parameter for a station for all periods of the cube
+
+        Inputs:-
+        self [object]: Instance of the current object
+        station [str]: Station number
+        param [str]: Parameter name e.g. 'Sea Level Pressure'
+        kind [int]: COMPUTED, GT or NO_SUSPECT
+        values [array-like]: Values for the months January to December (or days 1 to 366), NaN where absent
+
+        Output:- None
+        '''
+        self.cube[self.index[str(station)], :, PARAMS.index(param), kind] = np.asarray(values, dtype=np.float64)
+
+    def flush(self):
+        '''
+        Function:- Writes the changes of the cube to the disk
+        '''
+        self.cube.flush()
+
+    def pairs(self, params=None, stations=None, kind=COMPUTED):
+        '''
+        Function:- Returns all pairs of computed and ground truth values where both are present and non-zero
+
+        Inputs:-
+        self [object]: Instance of the current object
+        params [list]: Parameter names to be included. None includes all
+        stations [list]: Station numbers to be included. None includes all
+        kind [int]: Kind of the computed values, COMPUTED or NO_SUSPECT
+
+        Outputs:-
+        station_idx [np.ndarray]: Position of the station of each pair on the first axis
+        param_idx [np.ndarray]: Position of the parameter of each pair in PARAMS
+        period [np.ndarray]: Month (1 - Jan, 2 - Feb, etc.) or day of the year of each pair
+        computed [np.ndarray]: Computed values
+        ground_truth [np.ndarray]: Ground truth values
+        '''
+        cube = np.asarray(self.cube).transpose(0, 2, 1, 3) # Ordered as station, parameter, period like the consolidated data
+        computed, ground_truth = cube[..., kind], cube[..., GT]
+        valid = np.nan_to_num(computed) != 0
+        valid &= np.nan_to_num(ground_truth) != 0
+        if params is not None:
+            valid &= np.isin(np.arange(len(PARAMS)), [PARAMS.index(p) for p in params])[None, :, None]
+        if stations is not None:
+            valid &= np.isin(np.arange(len(self.stations)), [self.index[str(s)] for s in stations if str(s) in self.index])[:, None, None]
+        station_idx, param_idx, period_idx = np.nonzero(valid)
+        return station_idx, param_idx, period_idx + 1, computed[valid], ground_truth[valid]
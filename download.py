@@ -8,11 +8,99 @@ OUTPUT DIR: Archive
 '''
 
 # Importing libraries
-import os, requests, time, random, yaml
-from bs4 import BeautifulSoup
+import os, requests, time, random, yaml, json, threading, hashlib
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
 from urllib.parse import urljoin
 
+RETRY_STATUS = {429, 500, 502, 503, 504} # Status codes of throttling and transient server errors which are retried
+THROTTLE_STATUS = {429, 503} # Status codes which indicate that the server wants fewer requests
+NCEI_URL = "https://www.ncei.noaa.gov/data/local-climatological-data/access/" # Parent directory of the data of all years
+
+class Concurrency_Controller(): # Class for adapting the number of parallel downloads (additive increase, multiplicative decrease)
+    def __init__(self, initial=2, minimum=1, maximum=8, target_latency=5.0) -> None:
+        '''
+        Function:- Initializes an object
+
+        Inputs:-
+        self [object]: Instance of the current object
+        initial [int]: Number of parallel downloads to start with
+        minimum [int]: Minimum number of parallel downloads
+        maximum [int]: Maximum number of parallel downloads
+        target_latency [float]: Latency in seconds below which a response is considered healthy
+
+        Output:- None
+        '''
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.active = 0 # Number of downloads in progress
+        self.last_decrease = 0 # Time of the last decrease so that one burst of throttling halves the limit only once
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        '''
+        Function:- Waits until a download slot is free and takes it
+        '''
+        with self.condition:
+            while self.active >= max(self.minimum, int(self.limit)):
+                self.condition.wait()
+            self.active += 1
+
+    def release(self):
+        '''
+        Function:- Frees a download slot
+        '''
+        with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+    def on_throttle(self):
+        '''
+        Function:- Halves the limit when the server throttles the requests
+        '''
+        with self.condition:
+            now = time.monotonic()
+            if now - self.last_decrease > 1:
+                self.limit = max(self.minimum, self.limit/2)
+                self.last_decrease = now
+                print(f"Server is throttling, parallel downloads reduced to {int(self.limit)}")
+
+    def on_success(self, latency):
+        '''
+        Function:- Increases the limit by one per round of healthy responses
+        '''
+        with self.condition:
+            if latency <= self.target_latency:
+                self.limit = min(self.maximum, self.limit + 1/self.limit)
+                self.condition.notify_all()
+
+
 class Downloader():# Class for functions required to download files
+    def __init__(self, max_retries=5, backoff=1.0, max_backoff=60.0, max_concurrency=8, target_latency=5.0, max_retry_after=3600.0) -> None:
+        '''
+        Function:- Initializes an object
+
+        Inputs:-
+        self [object]: Instance of the current object
+        max_retries [int]: Maximum number of retries of a request which failed due to throttling or a transient error
+        backoff [float]: Delay in seconds before the first retry, doubled for each further retry
+        max_backoff [float]: Maximum delay in seconds of the exponential backoff between retries
+        max_concurrency [int]: Maximum number of parallel downloads
+        target_latency [float]: Latency in seconds below which the number of parallel downloads is increased
+        max_retry_after [float]: Maximum delay in seconds for which a Retry-After of the server is waited, guards against broken headers
+
+        Output:- None
+        '''
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_concurrency = max_concurrency
+        self.target_latency = target_latency
+        self.max_retry_after = max_retry_after
+        self.session = requests.Session() # Connections are reused between requests
+        self.latencies = [] # Latencies in seconds of all successful requests
 
     def get_size(self, path):
         '''
@@ -29,18 +117,83 @@ class Downloader():# Class for functions required to download files
         else:
             return -1
         
-    def basic_info(self):
+    def basic_info(self, base_url=None):
         '''
         Function: Provides the basic info of data
 
-        Input:- None
+        Input:-
+        base_url [str]: URL of a mirror of the NCEI website (e.g. the local server of mirror_server.py). None gives the NCEI website
 
         Output:- 
         main_url[str]: returns the main URL of the website of NCEI i.e. parent directory
         '''
-        main_url = "https://www.ncei.noaa.gov/data/local-climatological-data/access/"
+        main_url = base_url or NCEI_URL
+        if not main_url.endswith('/'): # urljoin drops the last part of the path without a trailing slash
+            main_url += '/'
         return main_url
 
+    def retry_delay(self, response, attempt):
+        '''
+        Function:- Computes the delay before the next retry. The Retry-After header of the server is honoured in full if present, otherwise exponential backoff with full jitter is used
+
+        Inputs:-
+        self [object]: Instance of the current object
+        response [requests object]: Response of the failed request, None if the connection failed
+        attempt [int]: Number of the failed attempt, starting at 0
+
+        Output:-
+        delay [float]: Delay in seconds
+        '''
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                delay = max(0.0, float(retry_after))
+            except ValueError: # Retry-After can also be an HTTP date
+                try:
+                    delay = max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+                except (TypeError, ValueError):
+                    delay = None
+            if delay is not None:
+                return min(delay, self.max_retry_after)
+        return random.uniform(0, min(self.max_backoff, self.backoff*2**attempt))
+
+    def get_with_retry(self, url, controller=None):
+        '''
+        Function:- Gets a URL, retrying on throttling (429, 503), transient server errors and connection errors
+
+        Inputs:-
+        self [object]: Instance of the current object
+        url [str]: URL to be fetched
+        controller [Concurrency_Controller]: Controller which is informed of throttling and of the latency of successful requests
+
+        Output:-
+        response [requests object]: Response of the last attempt, None if the connection failed on every attempt
+        '''
+        response = None
+        for attempt in range(self.max_retries + 1):
+            start = time.monotonic()
+            try:
+                response = self.session.get(url, timeout=60)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                response = None
+                print(f"Request to {url} failed: {e.__class__.__name__}")
+            else:
+                if response.status_code not in RETRY_STATUS:
+                    if response.status_code == 200:
+                        latency = time.monotonic() - start
+                        self.latencies.append(latency) # Kept for measuring the throughput and tail latency
+                        if controller is not None:
+                            controller.on_success(latency)
+                    return response
+                if controller is not None and response.status_code in THROTTLE_STATUS:
+                    controller.on_throttle()
+            if attempt < self.max_retries:
+                delay = self.retry_delay(response, attempt)
+                status = response.status_code if response is not None else 'no response'
+                print(f"Retrying {url} in {delay:.1f} s ({status}, attempt {attempt+1} of {self.max_retries})")
+                time.sleep(delay)
+        return response
+
     def fetch_URL(self, main_url, year): # Task 1
         '''
         Function: Fetches the URL from the web for a particular year
@@ -55,65 +208,209 @@ class Downloader():# Class for functions required to download files
         '''
         YYYY = str(year) + '/'
         base_url = urljoin(main_url, YYYY) # URL for the required year is made
-        response = requests.get(base_url) # Response for the website is collected
-        if response.status_code == 200: # Status Code 200 indicates that website can be accessed
+        response = self.get_with_retry(base_url) # Response for the website is collected
+        if response is not None and response.status_code == 200: # Status Code 200 indicates that website can be accessed
             print(f"Website for {year} is accessible")
             return response, base_url
         else:
-            print(f"Failed to access the website - Status Code: {response.status_code}")
+            print(f"Failed to access the website - Status Code: {response.status_code if response is not None else 'no response'}")
             return -1
         
-    def select_files(self, response, year, mode=None, inp_num_files = 100): # Task 2
+    def find_window(self, csv_links, mode=None):
+        '''
+        Function:- Finds the window of indices from which the files are sampled
+
+        Inputs:-
+        csv_links [list]: List of all csv links obtained by parsing the webpage
+        mode [str]: Mode which determines whether the files are selected from entire dataset or a subset
+
+        Outputs:-
+        start [int]: Index of the first file of the window
+        end_ [int]: Index of the last file of the window (inclusive)
+        '''
+        total_num_files = len(csv_links)
+        start, end_ = 0, total_num_files-1
+        if mode == 'specific': # Specific mode ensures that only the files starting with '7' are downloaded as it they are observed to have more amount of monthly data (GT)
+            # The links are sorted on the webpage, so the files starting with '7' form a contiguous block
+            prefixed = [i for i in range(total_num_files) if csv_links[i][0] == '7']
+            if prefixed:
+                start, end_ = prefixed[0], prefixed[-1]
+            print(f"Start = {start}, end = {end_}")
+        return start, end_
+
+    def sample_indices(self, csv_links, start, end_, num_files, seed=None, stratify=None, candidates=None):
+        '''
+        Function:- Samples indices without replacement from the window [start, end_]. Each draw is O(1), so k files are sampled in O(k) draws.
+
+        Inputs:-
+        csv_links [list]: List of all csv links obtained by parsing the webpage
+        start [int]: Index of the first file of the window
+        end_ [int]: Index of the last file of the window (inclusive)
+        num_files [int]: Number of files to be selected
+        seed [int]: Seed of the random number generator. None gives a different selection every run
+        stratify [int]: Length of the station prefix used as stratum (e.g. 2 groups stations by WMO block). None disables stratification
+        candidates [list]: Indices of the window from which the files are sampled, e.g. the files of the stations inside a region. None samples from the entire window
+
+        Output:-
+        indices [list]: List containing indices of the selected files
+        '''
+        rng = random.Random(seed) # Separate generator so that the selection depends only on the seed
+        window = range(start, end_+1) if candidates is None else candidates
+        num_files = min(num_files, len(window))
+        if not stratify:
+            return rng.sample(window, num_files)
+        strata = {} # Dictionary with station prefix as key and indices of its files as value
+        for i in window:
+            strata.setdefault(csv_links[i][:stratify], []).append(i)
+        # Files are allotted to each stratum in proportion to its size (largest remainder method)
+        shares = {key: num_files*len(members)/len(window) for key, members in strata.items()}
+        allotted = {key: int(share) for key, share in shares.items()}
+        remaining = num_files - sum(allotted.values())
+        for key in sorted(shares, key=lambda k: (allotted[k] - shares[k], k))[:remaining]:
+            allotted[key] += 1
+        indices = []
+        for key in sorted(strata): # Sorted so that the draws are reproducible for a given seed
+            indices.extend(rng.sample(strata[key], allotted[key]))
+        rng.shuffle(indices)
+        return indices
+
+    def manifest_path(self, directory, year, mode, num_files, seed, stratify, region=None, catalog=None):
+        '''
+        Function:- Returns the path of the selection manifest for a given set of parameters
+
+        Inputs:-
+        directory [str]: Directory in which the manifests are stored
+        year [int]: Year
+        mode [str]: Selection mode
+        num_files [int]: Number of files to be selected
+        seed [int]: Seed of the random number generator
+        stratify [int]: Length of the station prefix used as stratum
+        region [dict]: Region of the stations, None for no region
+        catalog [str]: Station catalog used to locate the stations of the region
+
+        Output:-
+        path [str]: Path of the manifest file
+        '''
+        filename = f"selection_{year}_{mode or 'all'}_n{num_files}_seed{seed}_strat{stratify or 0}"
+        if region: # Short digest of the region and catalog so that every region located with every catalog has its own manifest
+            key = {'region': region, 'catalog': catalog}
+            filename += '_region' + hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()[:8]
+        filename += '.json'
+        return os.path.join(directory, filename)
+
+    def select_files(self, response, year, mode=None, inp_num_files = 100, seed=None, stratify=None, manifest_dir='Selections', region=None, catalog=None): # Task 2
         '''
         Function:- Selects files for a particular randomly
 
         Inputs:-
         response [requests object]: Contains the response of the website
-        base_url [str]: URL of the data of particular year
+        year [int]: Year for which the data needs to be retrieved
         mode [str]: Mode which determines whether the files are selected from entire dataset or a subset for better performance in subsequent stages of the project
         inp_num_files [int]: Number of files to be downloaded
+        seed [int]: Seed of the random number generator. If given, the selection is persisted in a manifest and re-used by later runs
+        stratify [int]: Length of the station prefix used for stratified sampling. None disables stratification
+        manifest_dir [str]: Directory in which the selection manifests are stored
+        region [dict]: Region as {'bbox': [min_lat, min_lon, max_lat, max_lon]} or {'center': [lat, lon], 'radius_km': radius}. If given, only the files of the stations inside it are selected
+        catalog [str]: Path or URL of the station catalog used to locate the stations (see spatial.load_catalog). None gives the ISD station history of NCEI (spatial.CATALOG_URL)
 
         Outputs:-
         indices [list]: List containing indices of the selected files
         csv_links [list]: List of all csv links obtained by parsing the webpage
         '''
+        from bs4 import BeautifulSoup # Imported here as only this step needs the HTML parser
         # The HTML document of webpage of the particular year is parsed
         soup = BeautifulSoup(response.text, 'html.parser')
         # The CSV links are collected in a list from the parsed data
         csv_links = [a['href'] for a in soup.find_all('a', href=lambda href: (href and href.endswith('.csv')))]
         total_num_files = len(csv_links) # Total number of files on the webpage for a particular year
+        print(f"No. of files for the year {year} = {total_num_files}")
+        path = None
+        if region and catalog is None:
+            from spatial import CATALOG_URL
+            catalog = CATALOG_URL
+        if seed is not None: # Only seeded selections are reproducible and hence worth persisting
+            path = self.manifest_path(manifest_dir, year, mode, inp_num_files, seed, stratify, region, catalog)
+            if os.path.isfile(path):
+                with open(path) as f:
+                    selected = json.load(f)["files"]
+                positions = {link: i for i, link in enumerate(csv_links)}
+                indices = [positions[link] for link in selected if link in positions]
+                if indices: # An empty selection is never re-used
+                    print(f"Selection of {len(indices)} files re-used from {path}")
+                    return indices, csv_links
         # The number of files to be selected can be set using inp_num_files
         # This is done to extract a subset of data which can be processed further.
-        num_files = min(inp_num_files, total_num_files)
-        print(f"No. of files for the year {year} = {total_num_files}")
-        indices = []
-        if mode == 'specific': # Specific mode ensures that only the files starting with '7' are downloaded as it they are observed to have more amount of monthly data (GT)
-            ind_1, ind_2 = 0, 0
-            for i in range(total_num_files):
-                if csv_links[i][0] == '7' and ind_1 == 0:
-                    start = i
-                    ind_1 = 1
-                if csv_links[i][0] == '8' and ind_2 == 0:
-                    end_ = i-1
-                    ind_2 = 1
-                if ind_1 == 1 and ind_2 == 1:
-                    break
-            print(f"Start = {start}, end = {end_}")
-        else: # This is for selecting files randomly from entire dataset. In specific case too, the data is selected randomly.
-            start = 0
-            end_ = total_num_files-1
-        while len(indices) < num_files:
-            # An index is randomly picked from all the files available on the parsed webpage
-            idx = random.randint(start, end_) 
-            # If the index is already picked earlier, the inner loop ensures that an unique index is picked each time such that none of the files are repeated.
-            while idx in indices:
-                idx = random.randint(0, total_num_files-1)
-            indices.append(idx)
+        start, end_ = self.find_window(csv_links, mode)
+        candidates = None
+        if region:
+            from spatial import Station_Index, load_catalog # Imported here as only regional selections need the catalog
+            inside = set(Station_Index(load_catalog(catalog)).query(region))
+            candidates = [i for i in range(start, end_+1) if os.path.basename(csv_links[i])[:-4] in inside]
+            print(f"{len(candidates)} files of {len(inside)} catalogued stations are inside the region {region}")
+            if not candidates:
+                raise ValueError(f"No listed files of the year {year} are inside the region {region} according to the catalog {catalog}")
+        indices = self.sample_indices(csv_links, start, end_, inp_num_files, seed, stratify, candidates)
+        expected = min(inp_num_files, end_ - start + 1 if candidates is None else len(candidates))
+        if path and indices and len(indices) >= expected: # Only complete selections are persisted
+            os.makedirs(manifest_dir, exist_ok=True)
+            manifest = {
+                "year": year,
+                "mode": mode,
+                "n_locs": inp_num_files,
+                "seed": seed,
+                "stratify": stratify,
+                "region": region,
+                "catalog": catalog,
+                "files": [csv_links[i] for i in indices]
+            }
+            with open(path, 'w') as f:
+                json.dump(manifest, f, indent=4)
+            print(f"Selection manifest saved at {path}")
         return indices, csv_links
 
-    def fetch_files(self, directory, indices, csv_links, base_url, year):
+    def download_file(self, count, idx, csv_links, base_url, output_directory, controller):
+        '''
+        Function:- Downloads a single selected file into the archive unless it is already present
+
+        Inputs:-
+        count [int]: Number of the file in the selection
+        idx [int]: Index of the file in csv_links
+        csv_links [list]: List of all csv links obtained by parsing the webpage
+        base_url [str]: URL of the data of a particular year
+        output_directory [str]: Directory for storing the CSV files
+        controller [Concurrency_Controller]: Controller of the number of parallel downloads
+
+        Output:-
+        file_size [float]: Size of the file in MB, None if the download failed
+        '''
+        csv_link = csv_links[idx] # CSV link for current index
+        complete_url = urljoin(base_url, csv_link) # Constructing URL for this file
+        filename = os.path.basename(complete_url) # Same filename is used
+        output_path = os.path.join(output_directory, filename) # Path for the CSV file to be stored
+        if self.get_size(output_path) > 0: # Files of earlier runs are served from the local archive
+            print(f"File no. {count}: {csv_link}  [Index: {idx}] found in {output_directory}, skipping download")
+            return self.get_size(output_path)/(1024*1024)
+        controller.acquire()
+        try:
+            csv_response = self.get_with_retry(complete_url, controller) # Response of the CSV file on web is retrieved
+        finally:
+            controller.release()
+        if csv_response is not None and csv_response.status_code == 200: # Proceeds if the file is available
+            print(f"File no. {count}: {csv_link}  [Index: {idx}] is accessible")
+            temp_path = output_path + '.part' # Written to a temporary file first so that an interrupted download is never mistaken for a cached file
+            with open(temp_path, 'wb') as csv_file:
+                csv_file.write(csv_response.content) # Writing the CSV data in the file
+            os.replace(temp_path, output_path)
+            file_size = self.get_size(output_path)/(1024*1024) # Calculating file size in MB
+            print(f"Downloaded: {output_path} ({file_size:.1f} MB)")
+            return file_size
+        print(f"Failed to download: {filename} - Status Code: {csv_response.status_code if csv_response is not None else 'no response'}")
+        return None
+
+    def fetch_files(self, directory, indices, csv_links, base_url, year, on_complete=None, stop=None):
         '''
-        Function:- To download the selected files and store them in the archive
+        Function:- To download the selected files and store them in the archive. Files are downloaded in parallel, with the number of parallel downloads adapted to the throttling and latency of the server.
+        A file which fails after all retries is reported and skipped, the remaining files are still downloaded
 
         Inputs:-
         directory [str]: Name of output directory
@@ -121,56 +418,77 @@ class Downloader():# Class for functions required to download files
         csv_links [list]: List of all csv links obtained by parsing the webpage
         base_url [str]: URL of the data of a particular year
         year [int]: Year for which the files need to be extracted
+        on_complete [function]: Called as on_complete(output_directory, filename) as soon as each file is available in the archive, e.g. to refine it while the other files are downloading
+        stop [threading.Event]: If set, the files which have not started downloading are skipped
 
-        Output:- None. Files are stored in the archive
+        Output:-
+        failed [list]: List of csv links of the files which could not be downloaded
         '''
-        folder_size = 0 # Variable for calculating the size of folder of the given year
         print(f"Starting downloading files...\n")
         start = time.time()
         output_directory = os.path.join(directory, str(year)) # Directory for storing the CSV files
         os.makedirs(output_directory, exist_ok=True) # Creates the directory if not existing
-        # Iterating through each of the selected files' indices
-        for count, idx in enumerate(indices, start=1):
-            csv_link = csv_links[idx] # CSV link for current index
-            complete_url = urljoin(base_url, csv_link) # Constructing URL for this file
-            filename = os.path.basename(complete_url) # Same filename is used
-            csv_response = requests.get(complete_url) # Response of the CSV file on web is retrieved
-            if csv_response.status_code == 200: # Proceeds if the file is available
-                print(f"File no. {count}: {csv_link}  [Index: {idx}] is accessible")
-                output_path = os.path.join(output_directory, filename) # Path for the CSV file to be stored
-                with open(output_path, 'wb') as csv_file:
-                    csv_file.write(csv_response.content) # Writing the CSV data in the file
-                print(f"Downloaded: {output_path}")
-                file_size = (Downloader().get_size(output_path))/(1024*1024) # Calculating file size in MB
-                folder_size += file_size # Updating folder size
-                print(f"Size of file: {file_size:.1f} MB")
-                print(f"Size of folder {output_directory}: {folder_size:.1f} MB")
-                print()
-            else:
-                print(f"Failed to download: {filename} - Status Code: {csv_response.status_code}")
-                break
+        controller = Concurrency_Controller(maximum=self.max_concurrency, target_latency=self.target_latency)
+        skipped = []
+        def fetch(item): # Downloads a file and reports its completion
+            count, idx = item
+            if stop is not None and stop.is_set():
+                skipped.append(idx)
+                return None
+            size = self.download_file(count, idx, csv_links, base_url, output_directory, controller)
+            if size is not None and on_complete is not None:
+                on_complete(output_directory, os.path.basename(csv_links[idx]))
+            return size
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor: # Workers wait for a slot of the controller
+            sizes = list(executor.map(fetch, enumerate(indices, start=1)))
+        failed = [csv_links[idx] for idx, size in zip(indices, sizes) if size is None and idx not in skipped]
+        folder_size = sum(size for size in sizes if size is not None) # Size of folder of the given year
         end = time.time()
         total_num_files = len(csv_links)
-        print(f"Downloaded {count} files out of original {total_num_files} files successfully.")
+        print(f"Size of folder {output_directory}: {folder_size:.1f} MB")
+        print(f"Downloaded {len(indices) - len(failed) - len(skipped)} of {len(indices)} selected files out of original {total_num_files} files successfully.")
+        if skipped:
+            print(f"Stopped early, {len(skipped)} files were not downloaded.")
+        if failed:
+            print(f"Failed files: {', '.join(failed)}")
         print(f"Total time required: {((end-start)/60):.1f} minutes.")
+        return failed
+
+def run(year, config, on_complete=None, stop=None):
+    '''
+    Function:- Runs the download stage for a given year
+
+    Inputs:-
+    year [int]: Year for which the data needs to be downloaded
+    config [dict]: Parameters of the experiment as in params.yaml
+    on_complete [function]: Called as on_complete(output_directory, filename) as soon as each file is available in the archive
+    stop [threading.Event]: If set, the remaining files are not downloaded
+
+    Output:-
+    output_directory [str]: Directory in which the files of the year are stored
+    '''
+    n_locs = config["n_locs"] # Number of locations to be downloaded
+    seed = config.get("seed") # Seed for the selection of stations
+    stratify = config.get("stratify") # Length of station prefix used for stratified sampling
+    region = config.get("region") # Region of the stations, e.g. {'bbox': [min_lat, min_lon, max_lat, max_lon]}
+    mode = 'region' if region else 'specific' # Specific here implies special set of files starting with '7', region implies all files of the stations inside the region
+
+    downloader = Downloader(max_retries=config.get("max_retries", 5), max_concurrency=config.get("max_concurrency", 8)) # Instance of class
+    main_url = downloader.basic_info(config.get("base_url")) # Main URL is fetched
+    main_start = time.time()
+    output_dir = 'Archive' # Output directory
+    os.makedirs(output_dir, exist_ok=True) # Output directory is created
 
-# These two values are set by the year
-params = yaml.safe_load(open("params.yaml"))["params"] # Params are loaded from YAML file
-year = params["year"] # Year
-n_locs = params["n_locs"] # Number of locations to be downloaded
-mode = 'specific' # Specific here implies special set of files starting with '7'
+    print(f"Downloading data for the year {year}")
+    response, base_url = downloader.fetch_URL(main_url, year) # URL is fetched
+    indices, csv_links = downloader.select_files(response, year, mode, n_locs, seed, stratify, region=region, catalog=config.get("catalog")) # Files are selected
+    downloader.fetch_files(output_dir, indices, csv_links, base_url, year, on_complete, stop) # Files are fetched and stored in a folder
+    print(f"Downloading data for year {year} completed.\n")
+    curr_end = time.time()
+    print(f"Time required till now: {((curr_end-main_start)/60):.0f} minutes.\n")
+    return os.path.join(output_dir, str(year))
 
 # MAIN CODE
-downloader = Downloader() # Instance of class
-main_url = downloader.basic_info() # Main URL is fetched
-main_start = time.time()
-output_dir = 'Archive' # Output directory
-os.makedirs(output_dir, exist_ok=True) # Output directory is created
-
-print(f"Downloading data for the year {year}")
-response, base_url = downloader.fetch_URL(main_url, year) # URL is fetched
-indices, csv_links = downloader.select_files(response, year, mode, n_locs) # Files are selected
-downloader.fetch_files(output_dir, indices, csv_links, base_url, year) # Files are fetched and stored in a folder
-print(f"Downloading data for year {year} completed.\n")
-curr_end = time.time()
-print(f"Time required till now: {((curr_end-main_start)/60):.0f} minutes.\n")
\ No newline at end of file
+if __name__ == '__main__':
+    params = yaml.safe_load(open("params.yaml"))["params"] # Params are loaded from YAML file
+    run(params["year"], params)
@@ -7,46 +7,158 @@ OUTPUT DIR: Consolidated
 '''
 # Importing libraries
 import os, yaml
+from contextlib import closing
+import numpy as np
 import pandas as pd
-from sklearn.metrics import r2_score
-from dvclive import Live
+from cube import Aggregate_Cube, PARAMS, GT, NO_SUSPECT
+# dvclive is imported lazily in run() as it dominates the startup time of this stage
+
+def r2_score(y_true, y_pred):
+    '''
+    Function:- Computes the coefficient of determination (R2 score) natively in NumPy, equivalent to sklearn.metrics.r2_score for 1D inputs of atleast 2 values.
+    The score is not defined for fewer values, for which NaN is returned (sklearn returns NaN for a single value and raises an error for none)
+
+    Inputs:-
+    y_true [array-like]: Ground truth values
+    y_pred [array-like]: Predicted (computed) values
+
+    Output:-
+    score [float]: R2 score, NaN for fewer than 2 values
+    '''
+    y_true = np.asarray(y_true, dtype=np.float64)
+    y_pred = np.asarray(y_pred, dtype=np.float64)
+    if len(y_true) < 2:
+        return float('nan')
+    ss_res = np.sum((y_true - y_pred)**2) # Residual sum of squares
+    ss_tot = np.sum((y_true - y_true.mean())**2) # Total sum of squares
+    if ss_tot == 0: # Constant ground truth, handled the same way as sklearn
+        return 1.0 if ss_res == 0 else 0.0
+    return float(1 - ss_res/ss_tot)
 
 class Experiment_Records(): # Class for recording experimental data
-    def __init__(self) -> None:
+    def __init__(self, filename='Experiment Records.db', csv_filename='Experiment Records.csv') -> None:
         '''
-        Function: Initializes the class object and imports/creates dataframe for recording the r2 score
+        Function: Initializes the class object and opens/creates the SQLite database for recording the r2 score. The database is in WAL mode so that parallel runs can record safely.
+        If the database is new and the spreadsheet of earlier experiments exists, its rows are imported. Rows of the old spreadsheet (only Year and R2 Score) are each kept under their own key
+        (code version 'legacy-<row number>') and are dated from 1970-01-01 in their original order, as they have no timestamp.
+
+        Inputs:-
+        self [object]: Instance of the current object
+        filename [str]: Filename of the SQLite database
+        csv_filename [str]: Filename of the spreadsheet which is kept as an export of the database
         '''
-        filename = 'Experiment Records.csv' # FIlename
-        if not os.path.isfile(filename):
-            columns = ['Year', 'R2 Score']
-            df = pd.DataFrame(columns=columns)
-        else:
-            df = pd.read_csv(filename)
-        self.df = df
+        is_new = not os.path.isfile(filename)
         self.filename = filename
+        self.csv_filename = csv_filename
+        with closing(self.connect()) as conn, conn: # Committed as a single transaction and closed
+            conn.execute('''CREATE TABLE IF NOT EXISTS records (
+                year INTEGER NOT NULL,
+                n_locs INTEGER NOT NULL,
+                seed INTEGER NOT NULL,
+                code_version TEXT NOT NULL,
+                r2_score REAL NOT NULL,
+                recorded_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),
+                PRIMARY KEY (year, n_locs, seed, code_version)
+            )''') # Unseeded runs and runs whose n_locs is unknown are stored with seed and n_locs -1
+            conn.execute('CREATE INDEX IF NOT EXISTS records_by_year ON records (year, recorded_at)')
+            if is_new and os.path.isfile(csv_filename): # Records of the spreadsheet are imported once
+                df = pd.read_csv(csv_filename)
+                if 'Code Version' in df.columns: # Spreadsheet exported by this class, e.g. after the database was deleted
+                    for row in df.itertuples(index=False):
+                        self.upsert(conn, int(row[0]), float(row[1]), int(row[2]), int(row[3]), str(row[4]), str(row[5]))
+                else:
+                    for i, row in enumerate(df.itertuples(index=False)):
+                        recorded_at = (pd.Timestamp('1970-01-01') + pd.Timedelta(seconds=i)).strftime('%Y-%m-%d %H:%M:%S.000')
+                        self.upsert(conn, int(row[0]), float(row[1]), -1, -1, f'legacy-{i+1}', recorded_at)
+
+    def connect(self):
+        '''
+        Function: Opens a connection to the database in WAL mode, waiting for other writers instead of failing
+        '''
+        import sqlite3 # Imported here as only recording needs it
+        conn = sqlite3.connect(self.filename, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    @staticmethod
+    def code_version():
+        '''
+        Function: Returns the git commit of the code, 'unknown' if it is not available
+        '''
+        import subprocess
+        try:
+            return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return 'unknown'
+
+    def upsert(self, conn, year, score, n_locs, seed, code_version, recorded_at=None):
+        '''
+        Function: Inserts a record or replaces the score of an existing record with the same key. recorded_at defaults to the current time
+        '''
+        conn.execute('''INSERT INTO records (year, n_locs, seed, code_version, r2_score, recorded_at)
+            VALUES (?, ?, ?, ?, ?, COALESCE(?, strftime('%Y-%m-%d %H:%M:%f', 'now')))
+            ON CONFLICT (year, n_locs, seed, code_version) DO UPDATE SET
+            r2_score = excluded.r2_score, recorded_at = excluded.recorded_at''', (year, n_locs, seed, code_version, score, recorded_at))
 
-    def record(self, year, score):
+    def record(self, year, score, n_locs=None, seed=None):
         '''
-        Function: Records the current experiment's year and score and saves it in the spreadsheet
+        Function: Records the current experiment's year and score in the database and updates the spreadsheet. A repeated run with the same year, n_locs, seed and code version replaces the earlier record
 
         Inputs:-
         self [object]: Instance of the current object
         year [int]: Year
         score [float]: R2 score
+        n_locs [int]: Number of locations/stations which were downloaded
+        seed [int]: Seed of the selection of stations
 
         Output: None
         '''
-        self.df.loc[len(self.df.index)] = [year, score]
-        self.df.to_csv(self.filename, index=False)
-        
+        with closing(self.connect()) as conn, conn: # Committed as a single transaction and closed
+            self.upsert(conn, int(year), float(score), -1 if n_locs is None else int(n_locs), -1 if seed is None else int(seed), self.code_version())
+        self.export_csv()
+
+    def query(self, sql, params=()):
+        '''
+        Function: Runs a query on the database and returns the result as a dataframe
+        '''
+        with closing(self.connect()) as conn:
+            return pd.read_sql_query(sql, conn, params=params)
+
+    def latest(self, year=None):
+        '''
+        Function: Returns the latest record of each year (or of the given year)
+        '''
+        return self.query('''SELECT * FROM records r WHERE recorded_at = (SELECT MAX(recorded_at) FROM records WHERE year = r.year)
+            AND (? IS NULL OR year = ?) ORDER BY year''', (year, year))
+
+    def best(self, year=None):
+        '''
+        Function: Returns the record with the highest R2 score of each year (or of the given year)
+        '''
+        return self.query('''SELECT * FROM records r WHERE r2_score = (SELECT MAX(r2_score) FROM records WHERE year = r.year)
+            AND (? IS NULL OR year = ?) ORDER BY year''', (year, year))
+
+    def export_csv(self):
+        '''
+        Function: Exports all records to the spreadsheet, with the columns Year and R2 Score first as in earlier versions. The file is replaced atomically
+        '''
+        df = self.query('SELECT year, r2_score, n_locs, seed, code_version, recorded_at FROM records ORDER BY recorded_at')
+        df.columns = ['Year', 'R2 Score', 'N Locs', 'Seed', 'Code Version', 'Recorded At']
+        temp_filename = f'{self.csv_filename}.{os.getpid()}.tmp'
+        df.to_csv(temp_filename, index=False)
+        os.replace(temp_filename, self.csv_filename)
+
 
 class DataConsolidator(): # Class for functions used to consolidate data and evaluate R2 score
-    def __init__(self, directory, year) -> None:
+    def __init__(self, directory, year, config=None) -> None:
         '''
         Function:- Initializes an object
 
         Inputs:- 
         self [object]: Instance of the current object
+        directory [str]: Output directory of the consolidated data
+        year [int]: Year
+        config [dict]: Parameters of the experiment as in params.yaml, recorded with the score
 
         Output:- None
         '''
@@ -64,11 +176,14 @@ class DataConsolidator(): # Class for functions used to consolidate data and eva
             5: 10
         } # Related columns are used for evaluation. Eg. Computed Sea Level Pressure (Monthly Average) using Hourly Data and Ground Truth Sea Level Pressure (Monthly Data from website)
         self.df = df
+        self.frames = [] # Dataframes of pairs extracted from each file, combined by consolidate()
         self.columns = columns
         self.filename = filename
         self.related_cols = related_cols
         self.path = path
         self.year = year
+        self.config = config or {}
+        self.cube = None # Cube from which the pairs were extracted, if any
 
     def extract_useful_data(self, directory, filename):
         '''
@@ -86,40 +201,105 @@ class DataConsolidator(): # Class for functions used to consolidate data and eva
         data = data.fillna(0) # Null values are substituted by 0 for easy handling
         hourly_cols = list(self.related_cols.keys()) # List of columns which were computed using hourly data
         for col in hourly_cols: # Iterating through each column
+            computed = data.iloc[:, col] # Computed values
+            ground_truth = data.iloc[:, self.related_cols[col]] # Ground truth values
             # Checks if either of the columns of ground truth and computed values are entirely filled with zeros
-            if (data.iloc[:, col] == 0).all() == True or (data.iloc[:, self.related_cols[col]] == 0).all() == True:
+            if (computed == 0).all() == True or (ground_truth == 0).all() == True:
                 continue # Skips such columns
             col_name = data.columns[col] # Column name
             param = ' '.join(col_name.split(' ')[1:]) # Parameter name
-            for i in range(len(data.iloc[:, col])): # Iterating through each month for given pair of columns
-                computed = float(data.iloc[i, col]) # Computed value
-                ground_truth = float(data.iloc[i, self.related_cols[col]]) # Ground truth value
-                if computed != 0 and ground_truth != 0: # If both are non-zero, then their stored
-                    self.df.loc[len(self.df.index)] = [filename[:-4], param, computed, ground_truth]
+            pairs = (computed != 0) & (ground_truth != 0) # Months for which both are non-zero are stored
+            self.frames.append(pd.DataFrame({
+                'File No.': filename[:-4],
+                'Parameter': param,
+                'Computed': computed[pairs].astype(float),
+                'Ground Truth': ground_truth[pairs].astype(float)
+            }, columns=self.columns))
+
+    def extract_from_cube(self, cube):
+        '''
+        Function:- Extracts all pairs of ground truth and computed values of the year from the cube in a single vectorized slice
+
+        Inputs:-
+        self [object]: Instance of the current object
+        cube [Aggregate_Cube]: Cube of monthly averages of the year
+
+        Output:- None
+        '''
+        station_idx, param_idx, _, computed, ground_truth = cube.pairs()
+        self.frames.append(pd.DataFrame({
+            'File No.': np.asarray(cube.stations, dtype=object)[station_idx],
+            'Parameter': np.asarray(PARAMS, dtype=object)[param_idx],
+            'Computed': computed,
+            'Ground Truth': ground_truth
+        }, columns=self.columns))
+        print(f"Extracted {len(computed)} pairs of {len(cube.stations)} stations from {cube.path}")
+        self.cube = cube
+
+    def r2_breakdown(self):
+        '''
+        Function:- Computes the R2 score of each parameter from the consolidated data
+
+        Inputs:-
+        self [object]: Instance of the current object
+
+        Output:-
+        scores [dict]: Dictionary with parameter names as keys and R2 scores as values
+        '''
+        scores = {}
+        for param, group in self.df.groupby('Parameter', observed=True):
+            if len(group.index) < 2: # The score is not defined for a single pair
+                continue
+            scores[param] = r2_score(group['Ground Truth'], group['Computed'])
+            print(f"R2 Score of {param}: {scores[param]:.4f}")
+        return scores
+
+    def consolidate(self):
+        '''
+        Function:- Combines the pairs extracted from all files into the consolidated dataframe. Station numbers and parameter names are stored as categoricals as they repeat on every row
+
+        Inputs:-
+        self [object]: Instance of the current object
+
+        Output:- None
+        '''
+        if self.frames:
+            self.df = pd.concat([self.df] + self.frames, ignore_index=True) if len(self.df.index) else pd.concat(self.frames, ignore_index=True)
+            self.frames = []
+        for col in ['File No.', 'Parameter']:
+            self.df[col] = self.df[col].astype(str).astype('category')
 
     def save_consolidated_data(self):
         '''
-        Function:- Stores the consolidated data
+        Function:- Stores the consolidated data. The file is written to a temporary file first and replaced atomically, so that query_service.py never reads a half-written file
 
-        Inputs:- 
+        Inputs:-
         self [object]: Instance of the current object
 
         Output:- None
         '''
-        self.df.to_csv(self.path, index=False) # Stores as CSV file
-        print(f"Saved all data successfully at {self.path}.")
+        self.consolidate()
+        temp_path = f'{self.path}.{os.getpid()}.tmp'
+        self.df.to_csv(temp_path, index=False) # Stores as CSV file
+        os.replace(temp_path, self.path)
+        print(f"Saved all data successfully at {self.path}. Memory: {self.df.memory_usage(deep=True).sum()/1024:.1f} KB")
 
-    def compute_r2_score(self, live):
+    def compute_r2_score(self, live, daily_cube=None):
         '''
         Function:- Computes the R2 Score and determines consistency of dataset and also records it
 
         Inputs:- 
         self [object]: Instance of the current object
+        live [dvclive.Live]: Live object in which the score is logged
+        daily_cube [Aggregate_Cube]: Cube of daily averages and ground truths. If given, the R2 score of the daily pairs is also reported
 
-        Output:- None
+        Output:-
+        score [float]: R2 score
         '''
         computed_col = list(self.df['Computed']) # Computed column is extacted as list from consolidated data
         ground_truth_col = list(self.df['Ground Truth']) # Ground truth column is extacted as list from consolidated data
+        if len(ground_truth_col) < 2: # The score is not defined, so the year is neither judged nor recorded
+            raise ValueError(f"Only {len(ground_truth_col)} pairs of computed and ground truth values for the year {self.year}, the R2 score cannot be computed. Check that process.py and prepare.py have been run")
         score = r2_score(ground_truth_col, computed_col) # R2 score is computed
         print(f"R2 Score for the year {self.year} is {score:.4f}.", end=' ')
         if score >= 0.9: # Threshold for consistency is 0.9
@@ -128,29 +308,92 @@ class DataConsolidator(): # Class for functions used to consolidate data and eva
             print("This dataset is not consistent.")
         if not live.summary:
             live.summary = {"r2_score": {}}
-        live.summary["r2_score"][year] = score
-        Experiment_Records().record(self.year, score) # Record of this score is saved
+        live.summary["r2_score"][self.year] = score
+        live.summary.setdefault("r2_score_by_parameter", {})[self.year] = self.r2_breakdown()
+        granularity_scores = {"monthly": score}
+        if daily_cube is not None:
+            _, _, _, computed, ground_truth = daily_cube.pairs()
+            if len(computed) >= 2: # Enough pairs for a score
+                granularity_scores["daily"] = r2_score(ground_truth, computed)
+                print(f"R2 Score of {len(computed)} daily pairs: {granularity_scores['daily']:.4f}")
+        live.summary.setdefault("r2_score_by_granularity", {})[self.year] = granularity_scores
+        if self.cube is not None: # Averages computed by process.py without the suspect hourly values
+            _, _, _, computed, ground_truth = self.cube.pairs(kind=NO_SUSPECT)
+            if len(computed) >= 2:
+                live.summary.setdefault("r2_score_without_suspect", {})[self.year] = r2_score(ground_truth, computed)
+                print(f"R2 Score without suspect data: {live.summary['r2_score_without_suspect'][self.year]:.4f}")
+        live.summary.setdefault("stations", {})[self.year] = sorted(str(station) for station in self.df['File No.'].unique()) # Stations from which the pairs are taken
+        from progressive import load_report # Imported here as only runs of pipeline.py in progressive mode leave a report
+        report = load_report(self.year) # Running estimate of pipeline.py at which the downloads were stopped
+        if report is not None:
+            live.summary.setdefault("progressive", {})[self.year] = report
+        Experiment_Records().record(self.year, score, self.config.get('n_locs'), self.config.get('seed')) # Record of this score is saved
+        return score
+
+def run(year, config=None):
+    '''
+    Function:- Runs the evaluate stage for a given year
+
+    Inputs:-
+    year [int]: Year
+    config [dict]: Parameters of the experiment as in params.yaml
+
+    Output:-
+    score [float]: R2 score of the year
+    '''
+    from dvclive import Live # Imported lazily as it is only needed once the data is consolidated
+
+    main_input_dir = 'Prepared' # Input Directory of all years
+    input_dir = os.path.join(main_input_dir, str(year)) # Input Directory for specific year
+    main_output_dir = 'Consolidated' # Output Directory of all years
+    output_dir = os.path.join(main_output_dir, str(year)) # Output Directory for specific year
+    os.makedirs(main_output_dir, exist_ok=True) # Main Output directory is created
+    os.makedirs(output_dir, exist_ok=True) # Output directory is created
+
+    data_consolidator = DataConsolidator(output_dir, year, config) # Data consolidator object is generated
+    cube = Aggregate_Cube(year, mode='r') if Aggregate_Cube.exists(year) else None
+    missing = cube.stations_without(GT) if cube is not None else [] # e.g. prepare.py has not been run after process.py for some stations
+    if missing:
+        print(f"{len(missing)} of {len(cube.stations)} stations of the cube {cube.path} have no ground truths, the pairs are read from {input_dir} instead. Run prepare.py to fill the cube.")
+        cube = None
+    if cube is not None: # Pairs are sliced from the cube created by process.py and prepare.py
+        data_consolidator.extract_from_cube(cube)
+    else: # Otherwise they are read from the station-wise files
+        csv_files = [f for f in os.listdir(input_dir) if f.endswith(".csv")] # CSV filenames are listed
+        for iter, file in enumerate(csv_files, start=1): # Iterating through each filename
+            print(f"Processing File No. {iter}: {file}")
+            data_consolidator.extract_useful_data(input_dir, file) # Extracts the useful data
+            print()
+    data_consolidator.save_consolidated_data() # Saves the consolidated data
+    EVAL_PATH = "eval"
+    os.makedirs(EVAL_PATH, exist_ok=True)
+    with Live(EVAL_PATH, dvcyaml=False) as live:
+        daily_cube = Aggregate_Cube(year, mode='r', granularity='daily') if Aggregate_Cube.exists(year, granularity='daily') else None
+        missing = daily_cube.stations_without(GT) if daily_cube is not None else []
+        if missing: # A daily score of only some of the stations would not be comparable
+            print(f"{len(missing)} of {len(daily_cube.stations)} stations of the cube {daily_cube.path} have no ground truths, the daily R2 score is not reported. Run prepare.py to fill the cube.")
+            daily_cube = None
+        score = data_consolidator.compute_r2_score(live, daily_cube) # Finds R2 Score
+    return score
+
+def compare_years(years):
+    '''
+    Function:- Computes the R2 score of each parameter for several years from their cubes
+
+    Inputs:-
+    years [list]: Years to be compared
+
+    Output:-
+    scores [pd.DataFrame]: R2 scores with years as rows and parameters (and 'All') as columns
+    '''
+    scores = {}
+    for year in years:
+        _, param_idx, _, computed, ground_truth = Aggregate_Cube(year, mode='r').pairs()
+        scores[year] = {param: r2_score(ground_truth[param_idx == i], computed[param_idx == i]) for i, param in enumerate(PARAMS) if (param_idx == i).any()}
+        scores[year]['All'] = r2_score(ground_truth, computed)
+    return pd.DataFrame.from_dict(scores, orient='index')
 
 # MAIN CODE
-params = yaml.safe_load(open("params.yaml"))["params"] # Params are loaded from YAML file
-year = params["year"] # Year
-
-
-main_input_dir = 'Prepared' # Input Directory of all years
-input_dir = os.path.join(main_input_dir, str(year)) # Input Directory for specific year
-main_output_dir = 'Consolidated' # Output Directory of all years
-output_dir = os.path.join(main_output_dir, str(year)) # Output Directory for specific year
-os.makedirs(main_output_dir, exist_ok=True) # Main Output directory is created
-os.makedirs(output_dir, exist_ok=True) # Output directory is created
-
-data_consolidator = DataConsolidator(output_dir, year) # Data consolidator object is generated
-csv_files = [f for f in os.listdir(input_dir) if f.endswith(".csv")] # CSV filenames are listed
-for iter, file in enumerate(csv_files, start=1): # Iterating through each filename
-    print(f"Processing File No. {iter}: {file}")
-    data_consolidator.extract_useful_data(input_dir, file) # Extracts the useful data
-    print()
-data_consolidator.save_consolidated_data() # Saves the consolidated data
-EVAL_PATH = "eval"
-os.makedirs(EVAL_PATH, exist_ok=True)
-with Live(EVAL_PATH, dvcyaml=False) as live:
-    data_consolidator.compute_r2_score(live) # Finds R2 Score
\ No newline at end of file
+if __name__ == '__main__':
+    params = yaml.safe_load(open("params.yaml"))["params"] # Params are loaded from YAML file
+    run(params["year"], params)
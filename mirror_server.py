@@ -0,0 +1,273 @@
+'''
+OBJECTIVE OF THIS FILE:-
+
+THIS CODE RUNS A LOCAL MIRROR OF THE NCEI WEBSITE WHICH SERVES THE DIRECTORY LISTING OF EACH YEAR AND THE CSV FILES OF THE STATIONS, SO THAT THE DOWNLOAD STAGE CAN BE RUN AND BENCHMARKED WITHOUT NETWORK.
+THE FILES ARE SERVED FROM THE ARCHIVE IF THE YEAR HAS BEEN DOWNLOADED BEFORE, ELSE SYNTHETIC FILES IN THE FORMAT OF LOCAL CLIMATOLOGICAL DATA ARE GENERATED.
+LATENCY, BANDWIDTH AND ERROR RATES CAN BE INJECTED.
+INPUT DIR: Archive (optional)
+THE STATION HISTORY (isd-history.csv) WITH THE COORDINATES OF THE SYNTHETIC STATIONS IS ALSO SERVED FOR REGIONAL SELECTIONS.
+OUTPUT: HTTP responses e.g. GET /2002/, GET /2002/72263023034.csv and GET /isd-history.csv
+'''
+
+# Importing libraries
+import os, io, random, threading, time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import pandas as pd
+
+HOST = '127.0.0.1' # Host on which the mirror listens
+PORT = 8060 # Port on which the mirror listens
+
+LCD_COLUMNS = {
+    0: 'STATION', 1: 'DATE', 2: 'LATITUDE', 3: 'LONGITUDE', 4: 'ELEVATION', 5: 'NAME', 6: 'REPORT_TYPE', 7: 'SOURCE',
+    9: 'HourlyDewPointTemperature', 15: 'HourlyRelativeHumidity', 17: 'HourlySeaLevelPressure', 18: 'HourlyStationPressure', 20: 'HourlyWetBulbTemperature',
+    26: 'DailyAverageDewPointTemperature', 28: 'DailyAverageRelativeHumidity', 29: 'DailyAverageSeaLevelPressure', 30: 'DailyAverageStationPressure', 31: 'DailyAverageWetBulbTemperature',
+    46: 'MonthlyAverageRH', 59: 'MonthlyDewpointTemperature', 75: 'MonthlySeaLevelPressure', 76: 'MonthlyStationPressure', 79: 'MonthlyWetBulb'
+} # Positions of the columns used by the pipeline, the remaining columns of the 124 are left empty
+N_COLUMNS = 124 # Number of columns of a file of Local Climatological Data
+SYNTHETIC_PARAMS = [
+    # Hourly column, daily column, monthly column, mean, seasonal amplitude, noise, decimals
+    ('HourlyDewPointTemperature', 'DailyAverageDewPointTemperature', 'MonthlyDewpointTemperature', 40, 15, 4, 0),
+    ('HourlyRelativeHumidity', 'DailyAverageRelativeHumidity', 'MonthlyAverageRH', 65, 10, 12, 0),
+    ('HourlySeaLevelPressure', 'DailyAverageSeaLevelPressure', 'MonthlySeaLevelPressure', 30.0, 0.1, 0.15, 2),
+    ('HourlyStationPressure', 'DailyAverageStationPressure', 'MonthlyStationPressure', 29.5, 0.1, 0.15, 2),
+    ('HourlyWetBulbTemperature', 'DailyAverageWetBulbTemperature', 'MonthlyWetBulb', 50, 15, 4, 0)
+]
+
+def synthetic_coordinates(station, seed=0):
+    '''
+    Function:- Returns the latitude, longitude and elevation of a synthetic station, which are the same for all years so that the station history agrees with the files
+    '''
+    rng = np.random.default_rng([seed, int(''.join(c for c in station if c.isdigit()) or 0) % 2**32])
+    return round(rng.uniform(25, 49), 4), round(rng.uniform(-124, -67), 4), round(rng.uniform(0, 2000), 1)
+
+def synthetic_station_csv(station, year, hours_per_day=24, seed=0):
+    '''
+    Function:- Generates the CSV file of a station for a year in the format of Local Climatological Data. Hourly rows are followed by daily (SOD) and monthly (SOM) summary rows
+    whose values are the averages of the hourly values with some noise. A few hourly values are suffixed with 's' (suspect) or replaced by 'M' (missing) as in the real data
+
+    Inputs:-
+    station [str]: Station number
+    year [int]: Year
+    hours_per_day [int]: Number of hourly observations per day
+    seed [int]: Seed of the random number generator, the same station, year and seed always give the same file
+
+    Output:-
+    content [bytes]: Content of the CSV file
+    '''
+    rng = np.random.default_rng([seed, year, int(''.join(c for c in station if c.isdigit()) or 0) % 2**32])
+    hours = pd.date_range(f'{year}-01-01', f'{year}-12-31 23:59', freq=f'{24//hours_per_day}h')
+    days = pd.date_range(f'{year}-01-01', f'{year}-12-31', freq='D')
+    month_ends = pd.date_range(f'{year}-01-01', f'{year}-12-31', freq='ME')
+    n_hours, n_days, n_months = len(hours), len(days), len(month_ends)
+    n = n_hours + n_days + n_months
+    columns = [LCD_COLUMNS.get(i, f'Column{i}') for i in range(N_COLUMNS)]
+    frame = pd.DataFrame('', index=range(n), columns=columns, dtype=object)
+    frame['STATION'] = station
+    frame['DATE'] = np.concatenate([
+        hours.strftime('%Y-%m-%dT%H:%M:%S'),
+        (days + pd.Timedelta(hours=23, minutes=59)).strftime('%Y-%m-%dT%H:%M:%S'),
+        (month_ends + pd.Timedelta(hours=23, minutes=59)).strftime('%Y-%m-%dT%H:%M:%S')
+    ])
+    frame['REPORT_TYPE'] = ['FM-15'] * n_hours + ['SOD  '] * n_days + ['SOM  '] * n_months
+    frame['LATITUDE'], frame['LONGITUDE'], frame['ELEVATION'] = synthetic_coordinates(station, seed)
+    frame['NAME'] = f'SYNTHETIC STATION {station}, US'
+    day_of_hour = hours.dayofyear.to_numpy() - 1
+    month_of_day = days.month.to_numpy() - 1
+    for hourly_col, daily_col, monthly_col, mean, amplitude, noise, decimals in SYNTHETIC_PARAMS:
+        season = mean + amplitude*np.sin(2*np.pi*(day_of_hour - 100)/365)
+        values = np.round(season + rng.normal(0, noise, n_hours), decimals)
+        flag = rng.random(n_hours)
+        text = values.astype(str).astype(object)
+        text[flag < 0.02] = text[flag < 0.02] + 's' # Suspect values
+        text[(flag >= 0.02) & (flag < 0.03)] = 'M' # Missing values
+        frame.loc[:n_hours-1, hourly_col] = text
+        valid = flag >= 0.02
+        daily = np.bincount(day_of_hour[valid], values[valid], n_days)/np.maximum(np.bincount(day_of_hour[valid], minlength=n_days), 1)
+        frame.loc[n_hours:n_hours+n_days-1, daily_col] = np.round(daily, 2)
+        monthly = np.bincount(month_of_day, daily, n_months)/np.bincount(month_of_day, minlength=n_months)
+        frame.loc[n_hours+n_days:, monthly_col] = np.round(monthly + rng.normal(0, noise/20, n_months), 2)
+    frame = frame.sort_values('DATE', kind='stable')
+    buffer = io.StringIO()
+    frame.to_csv(buffer, index=False)
+    return buffer.getvalue().encode()
+
+
+class Mirror_Data(): # Class for the data served by the mirror
+    def __init__(self, archive_dir='Archive', n_stations=500, hours_per_day=24, seed=0, cache_size=64, catalog_years=range(2000, 2025)) -> None:
+        '''
+        Function:- Initializes an object
+
+        Inputs:-
+        self [object]: Instance of the current object
+        archive_dir [str]: Directory of the downloaded files of all years. Years present in it are served from it
+        n_stations [int]: Number of stations listed for a year which is not in the archive
+        hours_per_day [int]: Number of hourly observations per day of the synthetic files
+        seed [int]: Seed of the synthetic data and of the latencies and faults
+        cache_size [int]: Number of generated synthetic files kept in memory
+        catalog_years [iterable]: Years whose synthetic stations are listed in the station history
+
+        Output:- None
+        '''
+        self.archive_dir = archive_dir
+        self.n_stations = n_stations
+        self.hours_per_day = hours_per_day
+        self.seed = seed
+        self.cache_size = cache_size
+        self.catalog_years = catalog_years
+        self.cache = OrderedDict() # (year, filename) as key and content as value, in order of last use
+        self.lock = threading.Lock()
+
+    def listing(self, year):
+        '''
+        Function:- Returns the sorted filenames of the stations of a year
+        '''
+        directory = os.path.join(self.archive_dir, str(year))
+        if os.path.isdir(directory) and any(f.endswith('.csv') for f in os.listdir(directory)):
+            return sorted(f for f in os.listdir(directory) if f.endswith('.csv'))
+        rng = random.Random(f'{self.seed}-{year}')
+        # Station numbers are 11 digits, about 40% of them start with '7' as on the NCEI website
+        stations = {f"{'7' if rng.random() < 0.4 else rng.choice('0123456789')}{rng.randrange(10**10):010d}" for _ in range(self.n_stations)}
+        return sorted(f'{station}.csv' for station in stations)
+
+    def station_history(self):
+        '''
+        Function:- Returns the station history in the format of isd-history.csv of NCEI with the coordinates of the synthetic stations of catalog_years
+        '''
+        rows = ['"USAF","WBAN","STATION NAME","CTRY","STATE","ICAO","LAT","LON","ELEV(M)","BEGIN","END"']
+        for year in self.catalog_years:
+            for filename in self.listing(year):
+                station = filename[:-4]
+                lat, lon, elevation = synthetic_coordinates(station, self.seed)
+                rows.append(f'"{station[:6]}","{station[6:]}","SYNTHETIC STATION {station}","US","","","{lat:+.4f}","{lon:+.4f}","{elevation:+.1f}","{year}0101","{year}1231"')
+        return ('\n'.join(rows) + '\n').encode()
+
+    def file(self, year, filename):
+        '''
+        Function:- Returns the content of the CSV file of a station, None if the station is not listed for the year
+        '''
+        path = os.path.join(self.archive_dir, str(year), filename)
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                return f.read()
+        with self.lock:
+            if (year, filename) in self.cache:
+                self.cache.move_to_end((year, filename))
+                return self.cache[(year, filename)]
+        if filename not in self.listing(year):
+            return None
+        content = synthetic_station_csv(filename[:-4], year, self.hours_per_day, self.seed)
+        with self.lock:
+            self.cache[(year, filename)] = content
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return content
+
+
+class Mirror_Handler(BaseHTTPRequestHandler): # Class for handling the HTTP requests of the mirror
+    data = None # Mirror_Data, set by make_server
+    latency = 0.0 # Mean latency in seconds added to each response
+    bandwidth = None # Maximum bytes per second of each response, None for no limit
+    error_rate = 0.0 # Fraction of requests answered with 503
+    throttle_rate = 0.0 # Fraction of requests answered with 429 and Retry-After
+    retry_after = 1 # Value of the Retry-After header in seconds
+
+    def do_GET(self):
+        '''
+        Function:- Answers GET /<year>/ with the directory listing, GET /<year>/<STATION_NO>.csv with the file of the station and GET /isd-history.csv with the station history
+        '''
+        with self.rng_lock: # Draws of all threads come from the seeded generator of the server, so the latencies and faults of a run are reproducible
+            delay = self.rng.expovariate(1/self.latency) if self.latency else 0 # Exponentially distributed so that there is a tail
+            u = self.rng.random()
+        if delay:
+            time.sleep(delay)
+        if u < self.throttle_rate:
+            return self.send_status(429, {'Retry-After': str(self.retry_after)})
+        if u < self.throttle_rate + self.error_rate:
+            return self.send_status(503)
+        parts = [part for part in self.path.split('?')[0].split('/') if part]
+        if parts == ['isd-history.csv']:
+            return self.send_body(self.data.station_history(), 'text/csv')
+        if not parts or not parts[0].isdigit() or len(parts) > 2:
+            return self.send_status(404)
+        year = int(parts[0])
+        if len(parts) == 1:
+            links = ''.join(f'<a href="{f}">{f}</a>\n' for f in self.data.listing(year))
+            return self.send_body(f'<html><body><h1>Index of /{year}</h1>\n{links}</body></html>'.encode(), 'text/html')
+        content = self.data.file(year, parts[1])
+        if content is None:
+            return self.send_status(404)
+        self.send_body(content, 'text/csv')
+
+    def send_status(self, status, headers={}):
+        '''
+        Function:- Sends a response without a body
+        '''
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def send_body(self, content, content_type):
+        '''
+        Function:- Sends a response, in chunks paced to the bandwidth limit if one is set
+        '''
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        chunk = 64*1024
+        for i in range(0, len(content), chunk):
+            self.wfile.write(content[i:i+chunk])
+            if self.bandwidth:
+                time.sleep(len(content[i:i+chunk])/self.bandwidth)
+
+    def log_message(self, format, *args):
+        pass # Requests are not logged to keep the output clean
+
+
+def make_server(host=HOST, port=PORT, archive_dir='Archive', n_stations=500, hours_per_day=24, seed=0, latency=0.0, bandwidth=None, error_rate=0.0, throttle_rate=0.0, cache_size=64, retry_after=1):
+    '''
+    Function:- Creates the mirror server. Port 0 picks a free port, which is available as server.server_address[1]
+
+    Inputs:-
+    host [str]: Host on which the mirror listens
+    port [int]: Port on which the mirror listens
+    archive_dir [str]: Directory of the downloaded files of all years
+    n_stations [int]: Number of stations listed for a year which is not in the archive
+    hours_per_day [int]: Number of hourly observations per day of the synthetic files
+    seed [int]: Seed of the synthetic data and of the latencies and faults
+    latency [float]: Mean latency in seconds added to each response
+    bandwidth [float]: Maximum bytes per second of each response, None for no limit
+    error_rate [float]: Fraction of requests answered with 503
+    throttle_rate [float]: Fraction of requests answered with 429
+    cache_size [int]: Number of generated synthetic files kept in memory
+    retry_after [int]: Value of the Retry-After header in seconds of the throttled responses
+
+    Output:-
+    server [ThreadingHTTPServer]: Server which is started with serve_forever()
+    '''
+    handler = type('Handler', (Mirror_Handler,), {
+        'data': Mirror_Data(archive_dir, n_stations, hours_per_day, seed, cache_size),
+        'latency': latency,
+        'bandwidth': bandwidth,
+        'error_rate': error_rate,
+        'throttle_rate': throttle_rate,
+        'retry_after': retry_after,
+        'rng': random.Random(seed), # One generator per server so that servers do not share their draws
+        'rng_lock': threading.Lock()
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+# MAIN CODE
+if __name__ == '__main__':
+    server = make_server()
+    print(f"Serving the NCEI mirror on http://{HOST}:{PORT}/ (set base_url in params.yaml to use it)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
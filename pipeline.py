@@ -0,0 +1,135 @@
+'''
+OBJECTIVE OF THIS FILE:-
+
+THIS CODE RUNS ALL STAGES OF THE PIPELINE (DOWNLOAD, REFINE, PROCESS, PREPARE AND EVALUATE) FOR A GIVEN YEAR IN A SINGLE INTERPRETER AND REPORTS THE TIME TAKEN BY EACH STAGE
+IN STREAMING MODE, EACH DOWNLOADED FILE IS REFINED AS SOON AS IT LANDS IN THE ARCHIVE WHILE THE REMAINING FILES ARE STILL DOWNLOADING
+INPUT: params.yaml
+OUTPUT DIR: Same as that of the individual stages
+'''
+
+# Importing libraries
+import importlib, queue, sys, threading, time, yaml
+
+STAGES = ['download', 'refine', 'process', 'prepare', 'evaluate'] # Stages in the order in which they are run
+
+def run_stage(stage, year, config):
+    '''
+    Function:- Imports a stage module and runs it for a given year
+
+    Inputs:-
+    stage [str]: Name of the stage i.e. name of the module
+    year [int]: Year
+    config [dict]: Parameters of the experiment as in params.yaml
+
+    Outputs:-
+    result: Value returned by the run function of the stage
+    import_time [float]: Time in seconds required to import the stage
+    run_time [float]: Time in seconds required to run the stage
+    '''
+    start = time.perf_counter()
+    module = importlib.import_module(stage) # Stage is imported without any side effects
+    import_time = time.perf_counter() - start
+    start = time.perf_counter()
+    result = module.run(year, config)
+    run_time = time.perf_counter() - start
+    return result, import_time, run_time
+
+def stream_download_refine(year, config):
+    '''
+    Function:- Runs the download and refine stages together. Each completed download is put on a bounded queue from which a consumer thread refines it right away,
+    so that the network and CPU work overlap. The queue blocks the downloads when refining falls behind.
+    In progressive mode, each refined station is also folded into a running R2 estimate and the downloads stop once its confidence interval is clear of the threshold.
+    The report of the estimate is saved at Refined/<year>/progressive.json for evaluate.py
+
+    Inputs:-
+    year [int]: Year
+    config [dict]: Parameters of the experiment as in params.yaml. queue_size sets the size of the queue, progressive, confidence, margin and min_stations set the progressive mode
+
+    Output:-
+    useful_files_count [int]: Number of useful files which were refined
+    '''
+    import download, refine
+    from progressive import Progressive_R2, station_pairs, save_report, discard_report
+    stop = threading.Event() # Set when the progressive estimate is decided
+    estimator = Progressive_R2(config.get("confidence", 0.95), config.get("margin", 0.01), config.get("min_stations", 5), seed=config.get("seed") or 0) if config.get("progressive") else None
+    files = queue.Queue(maxsize=config.get("queue_size", 8)) # (directory, filename) of downloaded files, None marks the end
+    station_details = refine.Station_Details(year) # Only the consumer thread registers stations
+    output_dir = refine.output_directory(year)
+    counts = {'refined': 0, 'useful': 0}
+    errors = []
+
+    def consume(): # Refines the files in the order in which they are downloaded
+        while True:
+            item = files.get()
+            if item is None:
+                break
+            try:
+                counts['refined'] += 1
+                print(f"Iteration No. {counts['refined']}: Filename: {item[1]}")
+                file_object = refine.refine_file(item[0], item[1], output_dir, station_details)
+                if file_object is not None:
+                    counts['useful'] += 1
+                    if estimator is not None and not stop.is_set():
+                        estimator.add(item[1][:-4], *station_pairs(file_object.data, file_object.flags, refine.flag_bits(config.get("exclude_flags"))))
+                        score, lower, upper = estimator.estimate()
+                        decision = estimator.decision() # Same draw as the printed interval and the report
+                        print(f"Running R2 Score of {len(estimator.stations)} stations: {score:.4f} [{lower:.4f}, {upper:.4f}]")
+                        if decision is not None:
+                            print(f"Dataset is {decision} with {estimator.confidence:.0%} confidence, stopping downloads.")
+                            stop.set()
+            except Exception as e: # Reported after the downloads so that one bad file does not stop the stream
+                errors.append((item[1], e))
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    try:
+        download.run(year, config, on_complete=lambda directory, filename: files.put((directory, filename)), stop=stop)
+    finally:
+        files.put(None)
+        consumer.join()
+    print(f"{counts['useful']} useful files out of {counts['refined']} files.")
+    if estimator is not None:
+        save_report(estimator.report(), year)
+    else:
+        discard_report(year)
+    station_details.save_station_dataframe() # Saves station details of all useful stations
+    for filename, e in errors:
+        print(f"Failed to refine {filename}: {e}")
+    if errors:
+        raise errors[0][1]
+    return counts['useful']
+
+def run(year, config, stages=STAGES):
+    '''
+    Function:- Runs the given stages in order for a given year
+
+    Inputs:-
+    year [int]: Year
+    config [dict]: Parameters of the experiment as in params.yaml
+    stages [list]: Names of the stages to be run
+
+    Output:-
+    results [dict]: Dictionary with stage names as keys and values returned by the stages as values
+    '''
+    results, timings = {}, {}
+    stages = list(stages)
+    if (config.get("stream") or config.get("progressive")) and 'download' in stages and 'refine' in stages: # Both stages are run together as a stream
+        print(f"Running stages 'download' and 'refine' as a stream for the year {year}")
+        start = time.perf_counter()
+        results['download+refine'] = stream_download_refine(year, config)
+        timings['download+refine'] = (0.0, time.perf_counter() - start)
+        stages = [stage for stage in stages if stage not in ('download', 'refine')]
+    for stage in stages:
+        print(f"Running stage '{stage}' for the year {year}")
+        results[stage], import_time, run_time = run_stage(stage, year, config)
+        timings[stage] = (import_time, run_time)
+    print("Stage              Import (s)   Run (s)")
+    for stage, (import_time, run_time) in timings.items():
+        print(f"{stage:<18} {import_time:>10.3f} {run_time:>9.3f}")
+    return results
+
+# MAIN CODE
+if __name__ == '__main__':
+    params = yaml.safe_load(open("params.yaml"))["params"] # Params are loaded from YAML file
+    stages = sys.argv[1:] if len(sys.argv) > 1 else STAGES # Stages can optionally be passed as arguments e.g. python pipeline.py process prepare evaluate
+    run(params["year"], params, stages)
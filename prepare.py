@@ -2,14 +2,18 @@
 OBJECTIVE OF THIS FILE:-
 
 THIS CODE ITERATES THROUGH ALL CSV FILES FROM THE REFINED ARCHIVE AND COLLECTS THE GROUND TRUTHS OF MONTHLY AVERAGES FOR ALL PARAMETERS AND STORES IT STATION-WISE.
-INPUT DIR: Refined
+THE COMPUTED AVERAGES ARE READ FROM THE PROCESSED ARCHIVE AND WRITTEN ONCE ALONG WITH THE GROUND TRUTHS TO THE PREPARED ARCHIVE.
+INPUT DIR: Refined, Processed
 OUTPUT DIR: Prepared
 '''
 
 # Importing libraries
 import pandas as pd
 import numpy as np
-import os, re, yaml, shutil
+import os, yaml
+from refine import compact_hourly_frame
+from process import aggregate_by_period
+from cube import Aggregate_Cube, PARAMS, GT
 
 class Station_Details():# Class for dealing with station details and related functions
     def __init__(self, year) -> None:
@@ -95,7 +99,8 @@ class GT_Collector(): # Class for collecting ground truths and storing them
         } # New renames for the new df containing averages
         
         refined_path = os.path.join(refined_dir, filename) # Path is constructed
-        refined_data = pd.read_csv(refined_path) # Refined Archive's Data for given filename is fetched
+        refined_data = pd.read_csv(refined_path, low_memory=False) # Refined Archive's Data for given filename is fetched
+        compact_hourly_frame(refined_data) # Data is stored in compact dtypes
         print(f"The refined data from {refined_path} has been imported.")
 
         processed_path = os.path.join(processed_dir, filename) # Path is constructed
@@ -108,70 +113,15 @@ class GT_Collector(): # Class for collecting ground truths and storing them
         self.col_renames = col_renames
         pass
 
-    def convert_and_extract(self, row, col):
+    def calculate_GT_for_all_params(self, output_directory, cube=None, daily_cube=None):
         '''
-        Function:- Extracts and converts a given cell value to float. This function was useful for extracting numerical values from mistyped strings like '32s', '-41.43a', etc.
+        Function:- Collects ground truths for all parameters. Here averaging is done within a month to find average of given monthly values if there are multiple values for same month at a given station
 
         Inputs:- 
         self [object]: Instance of the current object
-        row [int]: Row index
-        col [int]: Column index
-
-        Output:- 
-        Extracted and converted float value
-        '''
-        var = self.refined_data.iloc[row, col]
-        try:
-            return float(var)
-        except ValueError:
-            pass
-        try:
-            match = re.search(r"(\-?\d+\.?\d*)", var)
-            if match:
-                return float(match.group(1))
-        except ValueError:
-            pass
-        return None
-
-    def calculate_ground_truth_per_param(self, col):
-        '''
-        Function:- Collects ground truths for a given parameter. Here averaging is done within a month to find average of given monthly values if there are multiple values for same month at a given station
-
-        Inputs:- 
-        self [object]: Instance of the current object
-        col [int]: Column index of a given parameter e.g. Dew Point Temperature
-
-        Output:-
-        average_dict [dict]: Dictionary containing the average values of the parameter as the values of the dictionary and keys are the month numbers (1 - Jan, 2 - Feb, etc.)
-        '''
-        counter_dict = {i: 0 for i in range(1, 13)} # Dictionary for counting the number of entries for each month
-        param_dict = {i: 0 for i in range(1, 13)} # Dictionary for summing up the entries for each month
-        n_samples = self.refined_data.shape[0] # Number of entries/samples
-        if self.refined_data.iloc[:, col].notna().any(): # If the entire column has atleast a non-null value, proceed...
-            for i in range(n_samples): # Iterating through the entries
-                # If the entry is not a null value and if it is convertible to float, then proceed...
-                if pd.notna(self.refined_data.iloc[i, col]) and self.convert_and_extract(i, col) != None:
-                    month = int(self.refined_data.iloc[i, 1]) # Extracting month
-                    param_dict[month] += self.convert_and_extract(i, col) # Summing up the parameter's entry to respective month
-                    counter_dict[month] += 1 # Updating count
-            average_dict = {i: 0 for i in range(1, 13)} # Dictionary containing average values
-            for key in average_dict.keys():
-                if counter_dict[key] == 0: # If count is 0, then the average is None
-                    print(f"Count for {key}th month for {col}th column = 0")
-                    avg = None
-                else:
-                    avg = param_dict[key]/counter_dict[key]
-                average_dict[key] = avg
-            return average_dict
-        return None
-    
-    def calculate_GT_for_all_params(self, output_directory):
-        '''
-        Function:- Collects ground truths for all parameters
-
-        Inputs:- 
-        self [object]: Instance of the current object
-        output_directory [str]: Output Directory
+        output_directory [str]: Output Directory, different from the processed directory
+        cube [Aggregate_Cube]: Cube of the year in which the ground truths are also stored
+        daily_cube [Aggregate_Cube]: Cube of the year in which the daily ground truths (Daily Average columns) are stored
 
         Output:-
         None
@@ -179,51 +129,68 @@ class GT_Collector(): # Class for collecting ground truths and storing them
         original_renames = list(self.col_renames.values())
         n_params = 5 # Number of parameters
         GT_array = np.zeros((12, n_params+1)) # 2D Array for storing ground truths
-        for i in range(12):
-            GT_array[i, 0] = i+1 # Storing month numbers in 1st column
+        GT_array[:, 0] = np.arange(1, 13) # Storing month numbers in 1st column
+        monthly, _ = aggregate_by_period(self.refined_data, self.refined_data.columns[10:15]) # Monthly values are averaged in a single pass
+        has_data = self.refined_data.iloc[:, 10:15].notna().any().to_numpy() # Parameters with atleast a non-null value
+        monthly.loc[:, ~has_data] = 0
+        GT_array[:, 1:] = monthly.to_numpy()
         for col in range(10, n_params+10): # Iterating through each parameter
-            op = self.calculate_ground_truth_per_param(col) # Output from function collecting the ground truths for a single parameter
-            if op:
-                average_dict = op
-                for month, avg in average_dict.items():
-                    GT_array[month-1, col-9] = avg # Averages are saved in appropriate cells
             self.processed_data[original_renames[col-5]] = GT_array[:, col-9]
+            if cube is not None:
+                param = original_renames[col-5][len('GT '):] # Parameter name e.g. 'Relative Humidity'
+                cube.store(self.filename[:-4], param, GT, GT_array[:, col-9])
+        if daily_cube is not None and 'DAY' in self.refined_data.columns:
+            _, daily = aggregate_by_period(self.refined_data, self.refined_data.columns[15:20]) # Daily Average columns, in the order of PARAMS
+            for i, param in enumerate(PARAMS):
+                daily_cube.store(self.filename[:-4], param, GT, daily.iloc[:, i])
         print(f"Calculated all ground truths for the file {self.filename}")
         path = os.path.join(output_directory, self.filename)
-        self.processed_data.to_csv(path, index=False) # Ground truths for given station have been saved to a CSV file as <STATION_NO>.csv in the directory 'Processed'
+        temp_path = f'{path}.{os.getpid()}.tmp' # Written to a temporary file first so that an interrupted run never leaves a partial file
+        self.processed_data.to_csv(temp_path, index=False) # Computed averages and ground truths for given station are saved to a CSV file as <STATION_NO>.csv in the directory 'Prepared'
+        os.replace(temp_path, path)
         print(f"Saved ground truths at {path}.")
 
-# MAIN CODE
-params = yaml.safe_load(open("params.yaml"))["params"] # Params are loaded from YAML file
-year = params["year"] # Year
-
-
-main_input_dir = 'Refined' # Input Directory of all years
-input_dir = os.path.join(main_input_dir, str(year)) # Input Directory for specific year
-
-main_output_dir = 'Processed' # Output Directory of all years
-output_dir = os.path.join(main_output_dir, str(year)) # Output Directory for specific year
+def run(year, config=None):
+    '''
+    Function:- Runs the prepare stage for a given year
+
+    Inputs:-
+    year [int]: Year
+    config [dict]: Parameters of the experiment as in params.yaml (unused by this stage)
+
+    Output:-
+    destination_dir [str]: Directory in which the prepared data of the year is stored
+    '''
+    main_input_dir = 'Refined' # Input Directory of all years
+    input_dir = os.path.join(main_input_dir, str(year)) # Input Directory for specific year
+
+    processed_dir = os.path.join('Processed', str(year)) # Directory of computed averages for specific year
+
+    main_output_dir = 'Prepared' # Output Directory of all years
+    destination_dir = os.path.join(main_output_dir, str(year)) # Output Directory for specific year
+    os.makedirs(destination_dir, exist_ok=True) # Output directory is created, files of an earlier run are replaced
+
+    station_details = Station_Details(year) # Station details are retrieved
+    station_details.find_useless_files() # Useless files are found
+    print()
+
+    cube = Aggregate_Cube(year) if Aggregate_Cube.exists(year) else None # Cubes created by process.py
+    daily_cube = Aggregate_Cube(year, granularity='daily') if Aggregate_Cube.exists(year, granularity='daily') else None
+    csv_files = [f for f in os.listdir(input_dir) if f.endswith(".csv")] # CSV filenames are listed
+    for iter, file in enumerate(csv_files, start=1): # Iterating through each filename
+        print(f"Processing File No. {iter}: {file}")
+        if station_details.check_utility(file) == -1: # Checking for usefulness of file
+            print(f"File No. {iter}: {file} is useless.")
+            continue
+        file_object = GT_Collector(input_dir, processed_dir, file) # File object is created
+        file_object.calculate_GT_for_all_params(destination_dir, cube, daily_cube) # Ground truths are collected and stored
+        print()
+    for c in [cube, daily_cube]:
+        if c is not None:
+            c.flush() # Ground truths are written to the cubes on disk
+    return destination_dir
 
-source_dir = output_dir
-destination_dir = os.path.join('Prepared', str(year))
-
-# Copy the folder (including subdirectories and files)
-shutil.copytree(source_dir, destination_dir)
-
-os.makedirs(main_output_dir, exist_ok=True) # Main Output directory is created
-os.makedirs(output_dir, exist_ok=True) # Output directory is created
-os.makedirs(destination_dir, exist_ok=True) # Output directory is created
-
-station_details = Station_Details(year) # Station details are retrieved
-station_details.find_useless_files() # Useless files are found
-print()
-
-csv_files = [f for f in os.listdir(input_dir) if f.endswith(".csv")] # CSV filenames are listed
-for iter, file in enumerate(csv_files, start=1): # Iterating through each filename
-    print(f"Processing File No. {iter}: {file}")
-    if station_details.check_utility(file) == -1: # Checking for usefulness of file
-        print(f"File No. {iter}: {file} is useless.")
-        continue
-    file_object = GT_Collector(input_dir, destination_dir, file) # File object is created
-    file_object.calculate_GT_for_all_params(destination_dir) # Ground truths are collected and stored
-    print()
\ No newline at end of file
+# MAIN CODE
+if __name__ == '__main__':
+    params = yaml.safe_load(open("params.yaml"))["params"] # Params are loaded from YAML file
+    run(params["year"], params)
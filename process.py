@@ -9,7 +9,9 @@ OUTPUT DIR: Processed
 # Importing libraries
 import pandas as pd
 import numpy as np
-import os, re, yaml
+import os, yaml
+from refine import compact_hourly_frame, frame_memory, load_flags, flag_bits, FLAGS
+from cube import Aggregate_Cube, PARAMS, COMPUTED, NO_SUSPECT
 
 class Station_Details():# Class for dealing with station details and related functions
     def __init__(self, year) -> None:
@@ -68,8 +70,34 @@ class Station_Details():# Class for dealing with station details and related fun
         return ind
 
 
+def aggregate_by_period(data, columns):
+    '''
+    Function:- Averages the given columns per day and per month in a single grouped pass over the data. The monthly averages are built from the daily sums and counts, so they are the same as averaging all values of the month
+
+    Inputs:-
+    data [pd.DataFrame]: Refined data with MONTH and (optionally) DAY columns
+    columns [list]: Names of the columns to be averaged
+
+    Outputs:-
+    monthly [pd.DataFrame]: Averages with month numbers (1 - 12) as index, NaN for months without data
+    daily [pd.DataFrame]: Averages with days of the year (1 - 366) as index, NaN for days without data. None if there is no DAY column
+    '''
+    values = data[columns].astype(np.float64) # Summed in double precision
+    keys = [data['MONTH'], data['DAY']] if 'DAY' in data.columns else [data['MONTH']]
+    grouped = values.groupby(keys).agg(['sum', 'count'])
+    sums = grouped.xs('sum', axis=1, level=1)
+    counts = grouped.xs('count', axis=1, level=1)
+    monthly_sums = sums.groupby(level=0).sum()
+    monthly_counts = counts.groupby(level=0).sum()
+    monthly = (monthly_sums/monthly_counts.where(monthly_counts > 0)).reindex(range(1, 13))
+    if 'DAY' not in data.columns:
+        return monthly, None
+    daily = (sums/counts.where(counts > 0)).droplevel(0).reindex(range(1, 367))
+    return monthly, daily
+
+
 class Monthly_Average_Calculator(): # Class for calculating montly averages and storing them
-    def __init__(self, directory, filename) -> None:
+    def __init__(self, directory, filename, exclude=0) -> None:
         '''
         Function:- Initializes an object
 
@@ -77,6 +105,7 @@ class Monthly_Average_Calculator(): # Class for calculating montly averages and
         self [object]: Instance of the current object
         directory [str]: Directory where refined data is stored
         filename [str]: Filename of the form <STATION_NO>.csv
+        exclude [int]: Bits of the flags (see refine.FLAGS) of the hourly values which are excluded from the averages, 0 includes all values
 
         Output:- None
         '''
@@ -94,77 +123,52 @@ class Monthly_Average_Calculator(): # Class for calculating montly averages and
         } # New renames for the new df containing averages
         # Instead of getting output from the prepare.py as list of fields, the fields which were useful were predefined by observing the column names
         path = os.path.join(directory, filename) # Path is constructed
-        data = pd.read_csv(path) # Refined Archive's Data for given filename is fetched
-        print(f"The data from {path} has been imported.")
+        data = pd.read_csv(path, low_memory=False) # Refined Archive's Data for given filename is fetched
+        memory = frame_memory(data)
+        compact_hourly_frame(data) # Data is stored in compact dtypes
+        print(f"The data from {path} has been imported. Memory: {memory:.2f} MB -> {frame_memory(data):.2f} MB")
+        flags = load_flags(path) # Flags of the values saved by refine.py
+        if len(flags) != len(data.index):
+            raise ValueError(f"Flags of {path} do not match the refined data. Run refine.py again for this year")
         self.data = data
+        self.flags = flags
+        self.exclude = exclude
         self.filename = filename
         self.col_renames = col_renames
         pass
 
-    def convert_and_extract(self, row, col):
+    def calculate_averages(self, exclude=0):
         '''
-        Function:- Extracts and converts a given cell value to float. This function was useful for extracting numerical values from mistyped strings like '32s', '-41.43a', etc.
+        Function:- Calculates the daily and monthly averages of all parameters in a single vectorized pass over the hourly data
 
         Inputs:- 
         self [object]: Instance of the current object
-        row [int]: Row index
-        col [int]: Column index
+        exclude [int]: Bits of the flags of the hourly values which are excluded, 0 includes all values
 
-        Output:- 
-        Extracted and converted float value
+        Outputs:-
+        monthly [pd.DataFrame]: Monthly averages with month numbers (1 - Jan, 2 - Feb, etc.) as index and parameters as columns. Months without data are NaN and parameters without any data are 0
+        daily [pd.DataFrame]: Daily averages with days of the year (1 - 366) as index and parameters as columns, None if the refined data has no DAY column
         '''
-        var = self.data.iloc[row, col]
-        try:
-            return float(var)
-        except ValueError:
-            pass
-        try:
-            match = re.search(r"(\-?\d+\.?\d*)", var)
-            if match:
-                return float(match.group(1))
-        except ValueError:
-            pass
-        return None
-
-    def calculate_monthly_average_per_param(self, col):
-        '''
-        Function:- Calculates monthly averages for a given parameter
-
-        Inputs:- 
-        self [object]: Instance of the current object
-        col [int]: Column index of a given parameter e.g. Dew Point Temperature
-
-        Output:-
-        average_dict [dict]: Dictionary containing the average values of the parameter as the values of the dictionary and keys are the month numbers (1 - Jan, 2 - Feb, etc.)
-        '''
-        counter_dict = {i: 0 for i in range(1, 13)} # Dictionary for counting the number of entries for each month
-        param_dict = {i: 0 for i in range(1, 13)} # Dictionary for summing up the entries for each month
-        n_samples = self.data.shape[0] # Number of entries/samples
-        if self.data.iloc[:, col].notna().any(): # If the entire column has atleast a non-null value, proceed...
-            for i in range(n_samples): # Iterating through the entries
-                # If the entry is not a null value and if it is convertible to float, then proceed...
-                if pd.notna(self.data.iloc[i, col]) and self.convert_and_extract(i, col) != None:
-                    month = int(self.data.iloc[i, 1]) # Extracting month
-                    param_dict[month] += self.convert_and_extract(i, col) # Summing up the parameter's entry to respective month
-                    counter_dict[month] += 1 # Updating count
-            average_dict = {i: 0 for i in range(1, 13)} # Dictionary containing average values
-            for key in average_dict.keys():
-                if counter_dict[key] == 0: # If count is 0, then the average is None
-                    print(f"Count for {key}th month for {col}th column = 0")
-                    avg = None
-                else:
-                    avg = param_dict[key]/counter_dict[key]
-                average_dict[key] = avg
-            return average_dict
-        return None
-    
-    def calculate_MA_for_all_params(self, output_directory):
+        data = self.data
+        if exclude: # Flagged values are masked out of a copy of the hourly columns only
+            data = self.data.iloc[:, 5:10].mask((self.flags[:, :5] & exclude) != 0)
+            for col in ['MONTH', 'DAY']:
+                if col in self.data.columns:
+                    data[col] = self.data[col]
+        monthly, daily = aggregate_by_period(data, self.data.columns[5:10])
+        has_data = self.data.iloc[:, 5:10].notna().any().to_numpy() # Parameters with atleast a non-null value
+        monthly.loc[:, ~has_data] = 0
+        return monthly, daily
+
+    def calculate_MA_for_all_params(self, output_directory, cube=None, daily_cube=None):
         '''
         Function:- Calculates monthly averages for all parameters
 
         Inputs:- 
         self [object]: Instance of the current object
         output_directory [str]: Output Directory
+        cube [Aggregate_Cube]: Cube of the year in which the monthly averages are also stored, along with the averages without the suspect values
+        daily_cube [Aggregate_Cube]: Cube of the year in which the daily averages are stored
 
         Output:-
         None
@@ -174,42 +178,71 @@ class Monthly_Average_Calculator(): # Class for calculating montly averages and
         columns.extend(original_renames[:5]) # Columns for a station
         n_params = 5 # Number of parameters
         MA_array = np.zeros((12, n_params+1)) # 2D Array for storing monthly averages
-        for i in range(12):
-            MA_array[i, 0] = i+1 # Storing month numbers in 1st column
-        for col in range(5, n_params+5): # Iterating through each parameter
-            op = self.calculate_monthly_average_per_param(col) # Output from function calculating the monthly averages for a single parameter
-            if op:
-                average_dict = op
-                for month, avg in average_dict.items():
-                    MA_array[month-1, col-4] = avg # Averages are saved in appropriate cells
+        monthly, daily = self.calculate_averages(self.exclude) # Daily and monthly averages from a single pass
+        MA_array[:, 0] = np.arange(1, 13) # Storing month numbers in 1st column
+        MA_array[:, 1:] = monthly.to_numpy() # Averages are saved in appropriate cells
         print(f"Calculated all monthly averages for the file {self.filename}")
+        if cube is not None:
+            for i, param in enumerate(PARAMS):
+                cube.store(self.filename[:-4], param, COMPUTED, MA_array[:, i+1])
+        if daily_cube is not None and daily is not None:
+            for i, param in enumerate(PARAMS):
+                daily_cube.store(self.filename[:-4], param, COMPUTED, daily.iloc[:, i])
+        if cube is not None or daily_cube is not None: # Averages without the suspect values, so that the R2 score can be reported with and without them
+            monthly_ns, daily_ns = self.calculate_averages(self.exclude | FLAGS['suspect'])
+            for i, param in enumerate(PARAMS):
+                if cube is not None:
+                    cube.store(self.filename[:-4], param, NO_SUSPECT, monthly_ns.iloc[:, i])
+                if daily_cube is not None and daily_ns is not None:
+                    daily_cube.store(self.filename[:-4], param, NO_SUSPECT, daily_ns.iloc[:, i])
         data_MA = pd.DataFrame(MA_array, columns=columns) # Pandas dataframe is created
         path = os.path.join(output_directory, self.filename)
         data_MA.to_csv(path, index=False) # Monthly averages for given station have been saved to a CSV file as <STATION_NO>.csv in the diretory 'Monthly Averages'
         print(f"Saved monthly averages at {path}.")
 
+def run(year, config=None):
+    '''
+    Function:- Runs the process stage for a given year
+
+    Inputs:-
+    year [int]: Year
+    config [dict]: Parameters of the experiment as in params.yaml. exclude_flags lists the flags of the hourly values which are excluded from the averages
+
+    Output:-
+    output_dir [str]: Directory in which the monthly averages of the year are stored
+    '''
+    exclude = flag_bits((config or {}).get('exclude_flags')) # e.g. ['suspect', 'estimated']
+    main_input_dir = 'Refined' # Input Directory of all years
+    input_dir = os.path.join(main_input_dir, str(year)) # Input Directory for specific year
+    main_output_dir = 'Processed' # Output Directory of all years
+    output_dir = os.path.join(main_output_dir, str(year)) # Output Directory for specific year
+    os.makedirs(main_output_dir, exist_ok=True) # Main Output directory is created
+    os.makedirs(output_dir, exist_ok=True) # Output directory is created
+
+    station_details = Station_Details(year) # Station details are retrieved
+    station_details.find_useless_files() # Useless files are found
+    print()
+
+    csv_files = [f for f in os.listdir(input_dir) if f.endswith(".csv")] # CSV filenames are listed
+    useful_files = []
+    for iter, file in enumerate(csv_files, start=1): # Iterating through each filename
+        if station_details.check_utility(file) == -1: # Checking for usefulness of file in terms of presence of latitude and longitude
+            print(f"File No. {iter}: {file} is useless.")
+            continue
+        useful_files.append(file)
+    stations = [file[:-4] for file in useful_files]
+    cube = Aggregate_Cube(year, stations) # Cube with a slot for every useful station
+    daily_cube = Aggregate_Cube(year, stations, granularity='daily')
+    for iter, file in enumerate(useful_files, start=1): # Iterating through each useful filename
+        print(f"Processing File No. {iter}: {file}")
+        file_object = Monthly_Average_Calculator(input_dir, file, exclude) # File object is created
+        file_object.calculate_MA_for_all_params(output_dir, cube, daily_cube) # Monthly and daily averages are calculated and stored
+        print()
+    cube.flush() # Averages are written to the cubes on disk
+    daily_cube.flush()
+    return output_dir
+
 # MAIN CODE
-params = yaml.safe_load(open("params.yaml"))["params"] # Params are loaded from YAML file
-year = params["year"] # Year
-
-
-main_input_dir = 'Refined' # Input Directory of all years
-input_dir = os.path.join(main_input_dir, str(year)) # Input Directory for specific year
-main_output_dir = 'Processed' # Output Directory of all years
-output_dir = os.path.join(main_output_dir, str(year)) # Output Directory for specific year
-os.makedirs(main_output_dir, exist_ok=True) # Main Output directory is created
-os.makedirs(output_dir, exist_ok=True) # Output directory is created
-
-station_details = Station_Details(year) # Station details are retrieved
-station_details.find_useless_files() # Useless files are found
-print()
-
-csv_files = [f for f in os.listdir(input_dir) if f.endswith(".csv")] # CSV filenames are listed
-for iter, file in enumerate(csv_files, start=1): # Iterating through each filename
-    print(f"Processing File No. {iter}: {file}")
-    if station_details.check_utility(file) == -1: # Checking for usefulness of file in terms of presence of latitude and longitude
-        print(f"File No. {iter}: {file} is useless.")
-        continue
-    file_object = Monthly_Average_Calculator(input_dir, file) # File object is created
-    file_object.calculate_MA_for_all_params(output_dir) # Monthly averages are calculated and stored
-    print()
\ No newline at end of file
+if __name__ == '__main__':
+    params = yaml.safe_load(open("params.yaml"))["params"] # Params are loaded from YAML file
+    run(params["year"], params)
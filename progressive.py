@@ -0,0 +1,212 @@
+'''
+OBJECTIVE OF THIS FILE:-
+
+THIS CODE ESTIMATES THE R2 SCORE OF A YEAR PROGRESSIVELY AS STATIONS FINISH, ALONG WITH A BOOTSTRAP CONFIDENCE INTERVAL OVER STATIONS.
+ONCE THE INTERVAL IS CLEARLY ABOVE OR BELOW THE THRESHOLD OF CONSISTENCY (0.9), THE REMAINING STATIONS NEED NOT BE DOWNLOADED.
+INPUT: Refined data of each station (in memory)
+OUTPUT: Decision and report (Refined/<year>/progressive.json) which is logged by evaluate.py
+'''
+
+# Importing libraries
+import json, os
+import numpy as np
+import pandas as pd
+from process import aggregate_by_period
+
+REPORT_FILENAME = 'progressive.json' # Report of the estimate at which the downloads were stopped, saved next to the refined files of the year
+THRESHOLD = 0.9 # Threshold of R2 score for a consistent dataset, same as in evaluate.py
+GT_ORDER = [1, 0, 2, 3, 4] # Positions of the monthly ground truth columns (RH, Dew Point, ...) in the order of the computed columns (Dew Point, RH, ...)
+
+def station_pairs(data, flags=None, exclude=0):
+    '''
+    Function:- Computes the pairs of computed and ground truth monthly averages of a station from its refined data, in the same way as process.py and prepare.py
+
+    Inputs:-
+    data [pd.DataFrame]: Refined data of the station
+    flags [np.ndarray]: Flag mask of the refined data (see refine.FLAGS)
+    exclude [int]: Bits of the flags of the hourly values which are excluded, as exclude_flags of process.py
+
+    Outputs:-
+    computed [np.ndarray]: Computed monthly averages of the pairs where both values are present and non-zero
+    ground_truth [np.ndarray]: Ground truth monthly averages of the same pairs
+    '''
+    if pd.isna(data.iloc[0, 2]) or pd.isna(data.iloc[0, 3]): # Stations without latitude or longitude are skipped as in process.py
+        return np.array([]), np.array([])
+    hourly = data
+    if exclude and flags is not None:
+        hourly = data.iloc[:, 5:10].mask((flags[:, :5] & exclude) != 0)
+        hourly['MONTH'] = data['MONTH']
+    computed, _ = aggregate_by_period(hourly[['MONTH'] + list(data.columns[5:10])], data.columns[5:10])
+    ground_truth, _ = aggregate_by_period(data, data.columns[10:15])
+    computed = computed.to_numpy()
+    ground_truth = ground_truth.to_numpy()[:, GT_ORDER]
+    valid = (np.nan_to_num(computed) != 0) & (np.nan_to_num(ground_truth) != 0)
+    return computed[valid], ground_truth[valid]
+
+
+class Progressive_R2(): # Class for the running estimate of the R2 score and its confidence interval
+    def __init__(self, confidence=0.95, margin=0.01, min_stations=5, n_bootstrap=500, seed=0) -> None:
+        '''
+        Function:- Initializes an object
+
+        Inputs:-
+        self [object]: Instance of the current object
+        confidence [float]: Confidence level of the interval
+        margin [float]: Margin by which the interval has to clear (or fall below) the threshold to stop early
+        min_stations [int]: Minimum number of stations before stopping early
+        n_bootstrap [int]: Number of bootstrap samples of the stations
+        seed [int]: Seed of the bootstrap so that the decision is reproducible
+
+        Output:- None
+        '''
+        self.confidence = confidence
+        self.margin = margin
+        self.min_stations = min_stations
+        self.n_bootstrap = n_bootstrap
+        self.rng = np.random.default_rng(seed)
+        self.stations = [] # Stations folded into the estimate
+        self.stats = [] # Sufficient statistics (n, sum of GT, sum of squared GT, sum of squared residuals) of each station
+        self.current = (np.nan, np.nan, np.nan, None) # Score, lower bound, upper bound and decision, recomputed once per station so that all readers see the same draw
+
+    def add(self, station, computed, ground_truth):
+        '''
+        Function:- Folds the pairs of a station into the estimate and updates the estimate and decision
+
+        Inputs:-
+        self [object]: Instance of the current object
+        station [str]: Station number
+        computed [array-like]: Computed values of the station
+        ground_truth [array-like]: Ground truth values of the station
+
+        Output:- None
+        '''
+        computed = np.asarray(computed, dtype=np.float64)
+        ground_truth = np.asarray(ground_truth, dtype=np.float64)
+        if len(computed) == 0: # Stations without pairs do not change the estimate
+            return
+        self.stations.append(str(station))
+        self.stats.append([len(computed), ground_truth.sum(), (ground_truth**2).sum(), ((ground_truth - computed)**2).sum()])
+        score, lower, upper = self.bootstrap()
+        self.current = (score, lower, upper, self.decide(lower, upper))
+
+    @staticmethod
+    def r2_from_stats(stats):
+        '''
+        Function:- Computes the R2 score from summed sufficient statistics, for one row or many rows at once
+        '''
+        n, sum_gt, sum_gt2, ss_res = np.moveaxis(np.asarray(stats, dtype=np.float64), -1, 0)
+        ss_tot = sum_gt2 - sum_gt**2/n
+        return 1 - ss_res/np.where(ss_tot > 0, ss_tot, np.nan)
+
+    def bootstrap(self):
+        '''
+        Function:- Computes the running R2 score and its bootstrap confidence interval. Stations (not pairs) are resampled, as the pairs of a station are not independent.
+        Each call draws a new sample, so it is only called by add()
+
+        Inputs:-
+        self [object]: Instance of the current object
+
+        Outputs:-
+        score [float]: R2 score of all pairs so far
+        lower [float]: Lower bound of the confidence interval
+        upper [float]: Upper bound of the confidence interval
+        '''
+        if not self.stats:
+            return np.nan, np.nan, np.nan
+        stats = np.array(self.stats)
+        score = float(self.r2_from_stats(stats.sum(axis=0)))
+        weights = self.rng.multinomial(len(stats), np.full(len(stats), 1/len(stats)), size=self.n_bootstrap) # Each row is a resample of the stations
+        samples = self.r2_from_stats(weights @ stats)
+        alpha = 1 - self.confidence
+        lower, upper = np.nanpercentile(samples, [100*alpha/2, 100*(1 - alpha/2)])
+        return score, float(lower), float(upper)
+
+    def estimate(self):
+        '''
+        Function:- Returns the estimate computed when the last station was added
+
+        Inputs:-
+        self [object]: Instance of the current object
+
+        Outputs:-
+        score [float]: R2 score of all pairs so far
+        lower [float]: Lower bound of the confidence interval
+        upper [float]: Upper bound of the confidence interval
+        '''
+        return self.current[:3]
+
+    def decide(self, lower, upper):
+        '''
+        Function:- Decides whether the dataset can already be judged from the bounds of the interval
+
+        Inputs:-
+        self [object]: Instance of the current object
+        lower [float]: Lower bound of the confidence interval
+        upper [float]: Upper bound of the confidence interval
+
+        Output:-
+        decision [str]: 'consistent' or 'inconsistent' if the interval clears or falls below the threshold by the margin, else None
+        '''
+        if len(self.stations) < self.min_stations:
+            return None
+        if lower >= THRESHOLD + self.margin:
+            return 'consistent'
+        if upper < THRESHOLD - self.margin:
+            return 'inconsistent'
+        return None
+
+    def decision(self):
+        '''
+        Function:- Returns the decision made when the last station was added, 'consistent', 'inconsistent' or None
+        '''
+        return self.current[3]
+
+    def report(self):
+        '''
+        Function:- Returns the estimate, interval, decision and stations used as a dictionary which can be logged
+        '''
+        score, lower, upper, decision = self.current
+        return {
+            'r2_score': score,
+            'lower': lower,
+            'upper': upper,
+            'confidence': self.confidence,
+            'decision': decision,
+            'n_stations': len(self.stations),
+            'stations': list(self.stations)
+        }
+
+
+def report_path(year):
+    '''
+    Function:- Returns the path of the report of the progressive estimate of a year
+    '''
+    return os.path.join('Refined', str(year), REPORT_FILENAME)
+
+def save_report(report, year):
+    '''
+    Function:- Saves the report of the progressive estimate of a year. The file is written under a temporary name and then renamed, so a partial report is never read
+    '''
+    path = report_path(year)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(report, f, indent=2, default=float) # numpy floats are written as floats
+    os.replace(path + '.tmp', path)
+    print(f"Report of the progressive estimate saved at {path}")
+
+def load_report(year):
+    '''
+    Function:- Loads the report of the progressive estimate of a year, None if the refined files of the year were not produced by a progressive run
+    '''
+    path = report_path(year)
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def discard_report(year):
+    '''
+    Function:- Removes the report of an earlier progressive run of a year, as it does not describe refined files which are produced without the estimate
+    '''
+    if os.path.isfile(report_path(year)):
+        os.remove(report_path(year))
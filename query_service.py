@@ -0,0 +1,220 @@
+'''
+OBJECTIVE OF THIS FILE:-
+
+THIS CODE RUNS A LOCAL HTTP SERVICE WHICH ANSWERS CONSISTENCY QUERIES (R2 SCORE FOR A GIVEN YEAR, STATION AND PARAMETER) FROM THE CONSOLIDATED DATA.
+THE AGGREGATES OF EACH YEAR ARE LOADED ONCE, KEPT IN AN LRU CACHE AND RELOADED WHEN THE CONSOLIDATED FILE OF THAT YEAR CHANGES.
+INPUT DIR: Consolidated
+OUTPUT: JSON responses over HTTP e.g. GET /r2?year=2002&station=72263023034&parameter=Sea Level Pressure
+'''
+
+# Importing libraries
+import os, json, threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, urlencode
+from urllib.error import HTTPError
+from urllib.request import urlopen
+import pandas as pd
+
+HOST = '127.0.0.1' # Host on which the service listens
+PORT = 8050 # Port on which the service listens
+
+class Year_Aggregates(): # Class for the sufficient statistics of R2 score of a year
+    def __init__(self, path) -> None:
+        '''
+        Function:- Loads the consolidated data of a year and reduces it to sums per station and parameter, from which the R2 score of any subset can be computed
+
+        Inputs:-
+        self [object]: Instance of the current object
+        path [str]: Path of the consolidated data of the year
+
+        Output:- None
+        '''
+        df = pd.read_csv(path, dtype={'File No.': str}) # Station numbers are kept as strings to preserve leading zeros
+        df['GT2'] = df['Ground Truth']**2
+        df['Residual2'] = (df['Ground Truth'] - df['Computed'])**2
+        grouped = df.groupby(['File No.', 'Parameter'])
+        sums = grouped[['Ground Truth', 'GT2', 'Residual2']].sum()
+        sums['n'] = grouped.size()
+        self.sums = sums # Indexed by (station, parameter)
+        self.mtime = os.path.getmtime(path)
+        self.path = path
+
+    def r2_score(self, station=None, parameter=None):
+        '''
+        Function:- Computes the R2 score of the pairs matching the given station and parameter
+
+        Inputs:-
+        self [object]: Instance of the current object
+        station [str]: Station number. None selects all stations
+        parameter [str]: Parameter name e.g. 'Sea Level Pressure'. None selects all parameters
+
+        Outputs:-
+        n [int]: Number of pairs of computed and ground truth values
+        score [float]: R2 score, None if there are fewer than 2 pairs as the score is not defined
+        '''
+        sums = self.sums
+        if station is not None:
+            sums = sums[sums.index.get_level_values(0) == station]
+        if parameter is not None:
+            sums = sums[sums.index.get_level_values(1) == parameter]
+        n = int(sums['n'].sum())
+        if n < 2:
+            return n, None
+        ss_res = sums['Residual2'].sum() # Residual sum of squares
+        ss_tot = sums['GT2'].sum() - sums['Ground Truth'].sum()**2/n # Total sum of squares
+        if ss_tot <= 0: # Constant ground truth
+            return n, 1.0 if ss_res == 0 else 0.0
+        return n, float(1 - ss_res/ss_tot)
+
+
+class Aggregate_Store(): # Class for caching the aggregates of recently queried years
+    def __init__(self, directory='Consolidated', capacity=8) -> None:
+        '''
+        Function:- Initializes an object
+
+        Inputs:-
+        self [object]: Instance of the current object
+        directory [str]: Directory of the consolidated data of all years
+        capacity [int]: Maximum number of years kept in memory
+
+        Output:- None
+        '''
+        self.directory = directory
+        self.capacity = capacity
+        self.cache = OrderedDict() # Year as key and Year_Aggregates as value, in order of last use
+        self.lock = threading.Lock()
+
+    def path(self, year):
+        '''
+        Function:- Returns the path of the consolidated data of a year
+        '''
+        return os.path.join(self.directory, str(year), f'Consolidated Data of {year}.csv')
+
+    def years(self):
+        '''
+        Function:- Lists the years for which consolidated data is available
+
+        Output:-
+        years [list]: Sorted list of years
+        '''
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(int(y) for y in os.listdir(self.directory) if y.isdigit() and os.path.isfile(self.path(y)))
+
+    def get(self, year):
+        '''
+        Function:- Returns the aggregates of a year, loading them if they are not cached or if the consolidated file has changed since they were loaded
+
+        Inputs:-
+        self [object]: Instance of the current object
+        year [int]: Year
+
+        Output:-
+        aggregates [Year_Aggregates]: Aggregates of the year, None if there is no consolidated data for the year.
+        If the file cannot be loaded (e.g. it is being rewritten), the error is raised and the cached aggregates are kept
+        '''
+        path = self.path(year)
+        if not os.path.isfile(path):
+            return None
+        with self.lock:
+            aggregates = self.cache.get(year)
+            if aggregates is None or aggregates.mtime != os.path.getmtime(path): # Only the changed year is reloaded
+                aggregates = Year_Aggregates(path)
+                print(f"Loaded aggregates of {year} from {path}")
+            self.cache[year] = aggregates
+            self.cache.move_to_end(year)
+            while len(self.cache) > self.capacity: # Least recently used years are evicted
+                self.cache.popitem(last=False)
+        return aggregates
+
+
+class Query_Handler(BaseHTTPRequestHandler): # Class for handling the HTTP requests
+    store = None # Aggregate_Store shared by all requests, set by make_server
+
+    def send_json(self, status, body, headers={}):
+        '''
+        Function:- Sends a JSON response
+        '''
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        '''
+        Function:- Answers GET /years and GET /r2?year=<YEAR>[&station=<STATION_NO>][&parameter=<PARAMETER>]
+        '''
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path == '/years':
+            return self.send_json(200, {'years': self.store.years()})
+        if url.path != '/r2':
+            return self.send_json(404, {'error': f'Unknown path {url.path}'})
+        if not query.get('year', '').isdigit():
+            return self.send_json(400, {'error': 'Parameter year is required'})
+        year = int(query['year'])
+        try:
+            aggregates = self.store.get(year)
+        except (OSError, pd.errors.EmptyDataError, pd.errors.ParserError) as e: # e.g. the consolidated file is being replaced, the request can be retried once evaluate.py has finished
+            return self.send_json(503, {'error': f'Consolidated data for {year} could not be loaded: {e}'}, {'Retry-After': '1'})
+        if aggregates is None:
+            return self.send_json(404, {'error': f'No consolidated data for {year}'})
+        station, parameter = query.get('station'), query.get('parameter')
+        n, score = aggregates.r2_score(station, parameter)
+        self.send_json(200, {'year': year, 'station': station, 'parameter': parameter, 'n': n, 'r2_score': score})
+
+    def log_message(self, format, *args):
+        pass # Requests are not logged to keep the output clean
+
+
+def make_server(host=HOST, port=PORT, directory='Consolidated', capacity=8):
+    '''
+    Function:- Creates the HTTP server. Port 0 picks a free port, which is available as server.server_address[1]
+
+    Inputs:-
+    host [str]: Host on which the service listens
+    port [int]: Port on which the service listens
+    directory [str]: Directory of the consolidated data of all years
+    capacity [int]: Maximum number of years kept in memory
+
+    Output:-
+    server [ThreadingHTTPServer]: Server which is started with serve_forever()
+    '''
+    handler = type('Handler', (Query_Handler,), {'store': Aggregate_Store(directory, capacity)})
+    return ThreadingHTTPServer((host, port), handler)
+
+def query(year, station=None, parameter=None, host=HOST, port=PORT):
+    '''
+    Function:- Local client which queries the R2 score from a running service
+
+    Inputs:-
+    year [int]: Year
+    station [str]: Station number. None selects all stations
+    parameter [str]: Parameter name. None selects all parameters
+    host [str]: Host of the service
+    port [int]: Port of the service
+
+    Output:-
+    response [dict]: Year, station, parameter, number of pairs and R2 score. For a failed query, the error of the service (e.g. {'error': 'No consolidated data for 2003'})
+    '''
+    params = {key: value for key, value in [('year', year), ('station', station), ('parameter', parameter)] if value is not None}
+    try:
+        with urlopen(f'http://{host}:{port}/r2?{urlencode(params)}') as response:
+            return json.loads(response.read())
+    except HTTPError as e: # Errors of the service (400, 404, 503) also have a JSON body
+        with e:
+            return json.loads(e.read())
+
+# MAIN CODE
+if __name__ == '__main__':
+    server = make_server()
+    print(f"Serving consistency queries on http://{HOST}:{PORT}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
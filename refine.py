@@ -8,8 +8,89 @@ OUTPUT DIR: Refined
 
 # Importing libraries
 import os, yaml
+import numpy as np
 import pandas as pd
 
+MEASUREMENT_PATTERN = r"(\-?\d+\.?\d*)" # Pattern of the numerical part of values like '32s', '-41.43a', etc.
+FLAGS = {
+    'suspect': 1, # Values suffixed with 's' e.g. '32s'
+    'estimated': 2, # Values suffixed with 'E'
+    'trace': 4, # 'T' i.e. trace amounts
+    'missing': 8, # 'M'
+    'other': 16 # Any other value which is not a plain number e.g. '-41.43a', '*'
+} # Bits of the flag mask of each measurement
+FLAG_PATTERNS = {'suspect': r's$', 'estimated': r'E$', 'trace': r'T$', 'missing': r'^M$'} # Patterns of the flags in the stripped raw values
+
+def flag_bits(names):
+    '''
+    Function:- Combines flag names like ['suspect', 'estimated'] into a bitmask which can be tested with flags & bits
+    '''
+    bits = 0
+    for name in names or []:
+        if name not in FLAGS:
+            raise ValueError(f"Unknown flag {name}, expected one of {list(FLAGS)}")
+        bits |= FLAGS[name]
+    return bits
+
+def load_flags(path):
+    '''
+    Function:- Loads the flag mask saved by refine.py next to a refined CSV file
+
+    Inputs:-
+    path [str]: Path of the refined CSV file
+
+    Output:-
+    flags [np.ndarray]: uint8 array of shape (rows, measurement columns)
+    '''
+    flags_path = path[:-4] + '_flags.npy'
+    if not os.path.isfile(flags_path):
+        raise FileNotFoundError(f"No flags at {flags_path} for the refined file {path}. Run refine.py again for this year")
+    return np.load(flags_path)
+
+def frame_memory(df):
+    '''
+    Function:- Returns the memory used by a dataframe in MB (including the contents of string columns)
+    '''
+    return df.memory_usage(deep=True).sum()/(1024*1024)
+
+def compact_hourly_frame(data, first_param_col=5):
+    '''
+    Function:- Converts a dataframe of hourly data to a memory-compact representation in place. Station numbers and names repeated on every row become categorical,
+    the month becomes int8 and the measurements become float32. Values like '32s' are converted in a single vectorized pass to the number they contain, and their flags are kept in a bitmask.
+
+    Inputs:-
+    data [pd.DataFrame]: Dataframe whose first columns are STATION, DATE/MONTH, LATITUDE, LONGITUDE, NAME followed by the measurement columns (and optionally DAY)
+    first_param_col [int]: Index of the first measurement column
+
+    Output:-
+    flags [np.ndarray]: uint8 array of shape (rows, measurement columns) with the bits of FLAGS set where the raw value was present but not a plain number (e.g. '32s', 'M', 'T'), 0 elsewhere
+    '''
+    for col in ['STATION', 'NAME']:
+        data[col] = data[col].astype('category')
+    if 'MONTH' in data.columns:
+        data['MONTH'] = data['MONTH'].astype(np.int8)
+    if 'DAY' in data.columns:
+        data['DAY'] = data['DAY'].astype(np.int16)
+    columns = data.columns[first_param_col:].drop('DAY', errors='ignore')
+    flags = np.zeros((len(data.index), len(columns)), dtype=np.uint8)
+    for i, col in enumerate(columns):
+        raw = data[col]
+        if pd.api.types.is_numeric_dtype(raw): # Columns which are already clean are only downcast
+            data[col] = raw.astype(np.float32)
+            continue
+        values = pd.to_numeric(raw, errors='coerce')
+        flagged = (values.isna() & raw.notna()).to_numpy()
+        if flagged.any(): # String operations only on the few flagged values
+            stripped = raw[flagged].astype(str).str.strip()
+            bits = np.zeros(len(stripped), dtype=np.uint8)
+            for name, pattern in FLAG_PATTERNS.items():
+                bits[stripped.str.contains(pattern).to_numpy()] |= FLAGS[name]
+            bits[bits == 0] = FLAGS['other']
+            flags[flagged, i] = bits
+        extracted = pd.to_numeric(raw.str.extract(MEASUREMENT_PATTERN, expand=False), errors='coerce') # Numbers are extracted from the remaining strings
+        data[col] = values.fillna(extracted).astype(np.float32)
+    return flags
+
 class Station_Details():# Class for dealing with station details and related functions
     def __init__(self, year) -> None:
         '''
@@ -93,7 +174,12 @@ class RefineData(): # Class for functions used to refine data
             'Monthly Dewpoint Temperature': 59, # 11
             'Monthly Sea Level Pressure': 75, # 12
             'Monthly Station Pressure': 76, # 13
-            'Monthly Wet Bulb Temperature': 79 # 14
+            'Monthly Wet Bulb Temperature': 79, # 14
+            'Daily Average Dew Point Temperature': 26, # 15
+            'Daily Average Relative Humidity': 28, # 16
+            'Daily Average Sea Level Pressure': 29, # 17
+            'Daily Average Station Pressure': 30, # 18
+            'Daily Average Wet Bulb Temperature': 31 # 19
         } # Dictionary of fields to be extracted from the downloaded data along with column numbers as values and commented numbers as new column indices
 
         useful_columns = [i for i in range(4)]
@@ -101,8 +187,12 @@ class RefineData(): # Class for functions used to refine data
         useful_columns.extend(fields.values()) # Indices of useful columns which are to be extracted
 
         path = os.path.join(directory, filename)
-        data = pd.read_csv(path, usecols=useful_columns) # Data from CSV file is fetched
-        print(f"The data from {path} has been imported.")
+        data = pd.read_csv(path, usecols=useful_columns, low_memory=False) # Data from CSV file is fetched
+        header = pd.read_csv(path, nrows=0).columns
+        data = data[[header[i] for i in useful_columns]] # Columns are ordered as the commented indices above (pandas keeps the order of the file)
+        memory = frame_memory(data)
+        self.flags = compact_hourly_frame(data) # Data is stored in compact dtypes, the flags of the values are kept aside
+        print(f"The data from {path} has been imported. Memory: {memory:.2f} MB -> {frame_memory(data):.2f} MB")
         self.data = data
         self.fields = fields
         self.filename = filename
@@ -118,10 +208,10 @@ class RefineData(): # Class for functions used to refine data
         
         Output:- None
         '''
-        for i in range(len(self.data['DATE'])):
-            s = self.data.loc[i, 'DATE'] # Extracting the string
-            month = int(s[5:7]) # Extracting month
-            self.data.loc[i, 'DATE'] = month # Setting it in the df
+        # Day of the year (1 - 366) is kept in the last column for the daily averages
+        self.data['DAY'] = pd.to_datetime(self.data['DATE'].str.slice(0, 10)).dt.dayofyear.astype(np.int16)
+        # Month is extracted from dates of the format YYYY-MM-DDTHH:MM:SS for all rows at once
+        self.data['DATE'] = self.data['DATE'].str.slice(5, 7).astype(np.int8)
         self.data.rename(columns={'DATE':'MONTH'}, inplace=True) # Renaming the date column
 
     def save_df_to_csv(self, path):
@@ -136,6 +226,8 @@ class RefineData(): # Class for functions used to refine data
         '''
         output_filename = os.path.join(path, self.filename) # Filename with path
         self.data.to_csv(output_filename, header=True, index=False)
+        flags_filename = output_filename[:-4] + '_flags.npy' # Flag mask is stored alongside as the CSV only has the numbers
+        np.save(flags_filename, self.flags)
         print(f"Refined CSV File stored at {output_filename}.")
 
     def check_col(self, col):
@@ -149,7 +241,8 @@ class RefineData(): # Class for functions used to refine data
         Output:-
         Boolean determining whether to proceed with a column or not
         '''
-        if self.data.iloc[:, col].notna().any(): # If the entire column has atleast a non-null value, proceed...
+        # If the entire column has atleast a non-null value (including values like 'M' which are not numbers), proceed...
+        if self.data.iloc[:, col].notna().any() or self.flags[:, col-5].any():
             return True
         return False
     
@@ -163,7 +256,7 @@ class RefineData(): # Class for functions used to refine data
         Output:-
         count [int]: Count of columns with atleast one non-null entry
         '''
-        columns = self.data.columns[5:] # Columns containing parameters
+        columns = self.data.columns[5:15] # Columns containing hourly and monthly parameters
         count = 0
         for col_no, _ in enumerate(columns, start=5):
             op = self.check_col(col_no)
@@ -192,32 +285,70 @@ class RefineData(): # Class for functions used to refine data
         ind = station_details.store_station_details(station_no, lat, long, station_name)
         return ind
 
-# MAIN CODE
-params = yaml.safe_load(open("params.yaml"))["params"] # Params are loaded from YAML file
-year = params["year"] # Year
-
+def refine_file(input_dir, csv_file, output_dir, station_details):
+    '''
+    Function:- Refines a single CSV file and registers its station if the file is useful
 
-station_details = Station_Details(year) # Station Details are imported
+    Inputs:-
+    input_dir [str]: Directory of the downloaded file
+    csv_file [str]: Filename of the downloaded file
+    output_dir [str]: Directory in which the refined file is stored
+    station_details [Station_Details]: Object containing station details
 
-main_input_dir = 'Archive' # Input Directory of all years
-input_dir = os.path.join(main_input_dir, str(year)) # Input Directory for specific year
-main_output_dir = 'Refined' # Output Directory of all years
-output_dir = os.path.join(main_output_dir, str(year)) # Output Directory for specific year
-os.makedirs(main_output_dir, exist_ok=True)  # Main Output directory is created
-os.makedirs(output_dir, exist_ok=True) # Output directory is created
-
-csv_files = [f for f in os.listdir(input_dir) if f.endswith(".csv")] # Names of CSV files are extracted for this year
-useful_files_count = 0
-for iter, csv_file in enumerate(csv_files): # Iterating through each CSV file
-    print(f"Iteration No. {iter+1}: Filename: {csv_file}")
+    Output:-
+    file_object [RefineData]: Refined data if the file is useful for subsequent analysis and has been saved, else None
+    '''
     file_object = RefineData(input_dir, csv_file) # File object for current file
     file_object.replace_date_by_month() # Date is replaced by month
     count = file_object.check_all_columns() # All columns are checked
     if count > 5: # Checks if the files are useful for subsequent analysis
         file_object.save_df_to_csv(output_dir) # Saves the CSV
         file_object.save_station_info(station_details) # Saves the station info
-        useful_files_count += 1 # Updates count
-    print()
-print(f"{useful_files_count} useful files out of {len(csv_files)} files.")
-station_details.save_station_dataframe() # Saves station details of all useful stations
-print("\n")
\ No newline at end of file
+        return file_object
+    return None
+
+def output_directory(year):
+    '''
+    Function:- Creates and returns the output directory of a year
+    '''
+    main_output_dir = 'Refined' # Output Directory of all years
+    output_dir = os.path.join(main_output_dir, str(year)) # Output Directory for specific year
+    os.makedirs(main_output_dir, exist_ok=True)  # Main Output directory is created
+    os.makedirs(output_dir, exist_ok=True) # Output directory is created
+    return output_dir
+
+def run(year, config=None):
+    '''
+    Function:- Runs the refine stage for a given year
+
+    Inputs:-
+    year [int]: Year
+    config [dict]: Parameters of the experiment as in params.yaml (unused by this stage)
+
+    Output:-
+    useful_files_count [int]: Number of useful files which were refined
+    '''
+    station_details = Station_Details(year) # Station Details are imported
+
+    main_input_dir = 'Archive' # Input Directory of all years
+    input_dir = os.path.join(main_input_dir, str(year)) # Input Directory for specific year
+    output_dir = output_directory(year)
+
+    csv_files = [f for f in os.listdir(input_dir) if f.endswith(".csv")] # Names of CSV files are extracted for this year
+    useful_files_count = 0
+    for iter, csv_file in enumerate(csv_files): # Iterating through each CSV file
+        print(f"Iteration No. {iter+1}: Filename: {csv_file}")
+        if refine_file(input_dir, csv_file, output_dir, station_details):
+            useful_files_count += 1 # Updates count
+        print()
+    print(f"{useful_files_count} useful files out of {len(csv_files)} files.")
+    station_details.save_station_dataframe() # Saves station details of all useful stations
+    from progressive import discard_report # Imported here as progressive.py imports this file
+    discard_report(year) # All files were refined without a progressive estimate
+    print("\n")
+    return useful_files_count
+
+# MAIN CODE
+if __name__ == '__main__':
+    params = yaml.safe_load(open("params.yaml"))["params"] # Params are loaded from YAML file
+    run(params["year"], params)
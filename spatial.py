@@ -0,0 +1,173 @@
+'''
+OBJECTIVE OF THIS FILE:-
+
+THIS CODE BUILDS A SPATIAL INDEX OVER THE COORDINATES OF THE STATIONS IN A STATION CATALOG, SO THAT THE STATIONS INSIDE A BOUNDING BOX OR WITHIN A RADIUS OF A POINT CAN BE FOUND WITHOUT SCANNING ALL STATIONS.
+download.py USES IT TO SELECT ONLY THE FILES OF THE STATIONS INSIDE A REGION.
+INPUT: Station catalog i.e. the ISD station history of NCEI (isd-history.csv) or a Station Details file of refine.py
+OUTPUT: Station numbers inside a region
+'''
+
+# Importing libraries
+import os
+import numpy as np
+import pandas as pd
+
+CATALOG_URL = "https://www.ncei.noaa.gov/pub/data/noaa/isd-history.csv" # Station history of NCEI with the coordinates of all stations
+EARTH_RADIUS = 6371.0088 # Mean radius of the Earth in km
+KM_PER_DEGREE = np.pi*EARTH_RADIUS/180 # Length of a degree of latitude in km
+
+def load_catalog(source=CATALOG_URL, cache_dir='Catalog'):
+    '''
+    Function:- Loads the station catalog with the coordinates of the stations
+
+    Inputs:-
+    source [str]: Path or URL of a catalog. Files in the format of isd-history.csv (USAF, WBAN, LAT, LON) as well as Station Details files of refine.py are accepted
+    cache_dir [str]: Directory in which a downloaded catalog is stored so that it is downloaded only once
+
+    Output:-
+    catalog [pd.DataFrame]: Dataframe with columns 'Station Number' (str), 'Latitude' and 'Longitude', one row per station
+    '''
+    if source.startswith(('http://', 'https://')):
+        path = os.path.join(cache_dir, os.path.basename(source.split('?')[0]))
+        if not os.path.isfile(path):
+            from download import Downloader # Imported here so that the retries of the download stage are used
+            response = Downloader().get_with_retry(source)
+            if response is None or response.status_code != 200:
+                raise RuntimeError(f"Failed to download the station catalog from {source}")
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(path + '.part', 'wb') as f:
+                f.write(response.content)
+            os.replace(path + '.part', path)
+            print(f"Station catalog downloaded from {source} and saved at {path}")
+    else:
+        path = source
+    catalog = pd.read_csv(path, dtype=str)
+    if 'USAF' in catalog.columns: # ISD station history, LCD files are named by USAF and WBAN numbers
+        catalog = pd.DataFrame({
+            'Station Number': catalog['USAF'].str.zfill(6) + catalog['WBAN'].str.zfill(5),
+            'Latitude': catalog['LAT'],
+            'Longitude': catalog['LON']
+        })
+    else: # Station Details files store the station numbers as integers, so the leading zeros of the 11 digit numbers of the filenames are restored
+        numbers = catalog['Station Number'].str.strip().str.replace(r'\.0$', '', regex=True)
+        catalog['Station Number'] = numbers.where(~numbers.str.isdigit(), numbers.str.zfill(11))
+    catalog = catalog[['Station Number', 'Latitude', 'Longitude']].copy()
+    catalog['Latitude'] = pd.to_numeric(catalog['Latitude'], errors='coerce')
+    catalog['Longitude'] = pd.to_numeric(catalog['Longitude'], errors='coerce')
+    catalog = catalog.dropna().drop_duplicates('Station Number', keep='last') # Stations without coordinates cannot be located
+    catalog = catalog[catalog['Latitude'].between(-90, 90) & catalog['Longitude'].between(-180, 180)]
+    print(f"Station catalog of {len(catalog)} stations loaded.")
+    return catalog.reset_index(drop=True)
+
+
+def haversine(lat, lon, lats, lons):
+    '''
+    Function:- Computes the great-circle distances in km from a point to many points
+    '''
+    lat, lon, lats, lons = np.radians(lat), np.radians(lon), np.radians(lats), np.radians(lons)
+    a = np.sin((lats - lat)/2)**2 + np.cos(lat)*np.cos(lats)*np.sin((lons - lon)/2)**2
+    return 2*EARTH_RADIUS*np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+class Station_Index(): # Class for the grid index over the coordinates of the stations
+    def __init__(self, catalog, cell_size=1.0) -> None:
+        '''
+        Function:- Builds the index. Stations are bucketed into cells of cell_size x cell_size degrees, so a query only looks at the stations in the cells overlapping the region
+
+        Inputs:-
+        self [object]: Instance of the current object
+        catalog [pd.DataFrame]: Station catalog as returned by load_catalog
+        cell_size [float]: Size of a cell of the grid in degrees
+
+        Output:- None
+        '''
+        self.stations = catalog['Station Number'].astype(str).to_numpy()
+        self.lat = catalog['Latitude'].to_numpy(dtype=np.float64)
+        self.lon = catalog['Longitude'].to_numpy(dtype=np.float64)
+        self.cell_size = cell_size
+        rows, cols = self.cell(self.lat, self.lon)
+        keys = rows*self.n_cols() + cols
+        order = np.argsort(keys, kind='stable')
+        cells, starts = np.unique(keys[order], return_index=True)
+        self.cells = dict(zip(cells.tolist(), np.split(order, starts[1:]))) # Cell number as key and positions of its stations as value
+
+    def n_cols(self):
+        '''
+        Function:- Returns the number of cells along the longitude
+        '''
+        return int(np.ceil(360/self.cell_size)) + 1
+
+    def cell(self, lat, lon):
+        '''
+        Function:- Returns the row and column of the cells of the given coordinates
+        '''
+        return np.floor((np.asarray(lat) + 90)/self.cell_size).astype(int), np.floor((np.asarray(lon) + 180)/self.cell_size).astype(int)
+
+    def candidates(self, min_lat, min_lon, max_lat, max_lon):
+        '''
+        Function:- Returns the positions of the stations in the cells overlapping a bounding box (which does not cross the antimeridian)
+        '''
+        (row_0, row_1), (col_0, col_1) = self.cell([min_lat, max_lat], [min_lon, max_lon])
+        n_cols = self.n_cols()
+        found = [self.cells[key] for row in range(row_0, row_1+1) for key in range(row*n_cols + col_0, row*n_cols + col_1+1) if key in self.cells]
+        return np.concatenate(found) if found else np.array([], dtype=int)
+
+    def within_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        '''
+        Function:- Finds the stations inside a bounding box. A box with min_lon > max_lon crosses the antimeridian
+
+        Inputs:-
+        self [object]: Instance of the current object
+        min_lat, min_lon, max_lat, max_lon [float]: Corners of the bounding box in degrees
+
+        Output:-
+        stations [list]: Station numbers inside the box, sorted
+        '''
+        if min_lon > max_lon: # Split into the boxes on either side of the antimeridian
+            return sorted(self.within_bbox(min_lat, min_lon, max_lat, 180) + self.within_bbox(min_lat, -180, max_lat, max_lon))
+        positions = self.candidates(min_lat, min_lon, max_lat, max_lon)
+        inside = (self.lat[positions] >= min_lat) & (self.lat[positions] <= max_lat) & (self.lon[positions] >= min_lon) & (self.lon[positions] <= max_lon)
+        return sorted(self.stations[positions[inside]].tolist())
+
+    def within_radius(self, lat, lon, radius_km):
+        '''
+        Function:- Finds the stations within a great-circle distance of a point
+
+        Inputs:-
+        self [object]: Instance of the current object
+        lat, lon [float]: Coordinates of the centre in degrees
+        radius_km [float]: Radius in km
+
+        Output:-
+        stations [list]: Station numbers within the radius, nearest first
+        '''
+        d_lat = radius_km/KM_PER_DEGREE
+        min_lat, max_lat = max(lat - d_lat, -90), min(lat + d_lat, 90)
+        d_lon = 180 # The circle contains a pole, so all longitudes are covered
+        if min_lat > -90 and max_lat < 90: # Degrees of longitude shrink with the cosine of the latitude, the widest extent is at the latitude farthest from the equator
+            d_lon = min(d_lat/np.cos(np.radians(max(abs(min_lat), abs(max_lat)))), 180)
+        if lon - d_lon < -180 or lon + d_lon > 180: # Circles crossing the antimeridian look at the whole band of latitudes
+            positions = self.candidates(min_lat, -180, max_lat, 180)
+        else:
+            positions = self.candidates(min_lat, lon - d_lon, max_lat, lon + d_lon)
+        distance = haversine(lat, lon, self.lat[positions], self.lon[positions])
+        inside = distance <= radius_km
+        order = np.argsort(distance[inside], kind='stable')
+        return self.stations[positions[inside][order]].tolist()
+
+    def query(self, region):
+        '''
+        Function:- Finds the stations inside a region given as in params.yaml
+
+        Inputs:-
+        self [object]: Instance of the current object
+        region [dict]: Either {'bbox': [min_lat, min_lon, max_lat, max_lon]} or {'center': [lat, lon], 'radius_km': radius}
+
+        Output:-
+        stations [list]: Station numbers inside the region
+        '''
+        if 'bbox' in region:
+            return self.within_bbox(*region['bbox'])
+        if 'center' in region and 'radius_km' in region:
+            return self.within_radius(*region['center'], region['radius_km'])
+        raise ValueError(f"Region {region} should have either bbox or center and radius_km")
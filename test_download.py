@@ -0,0 +1,67 @@
+'''
+OBJECTIVE OF THIS FILE:-
+
+THIS CODE TESTS THE RETRIES AND THE ADAPTIVE CONCURRENCY OF THE DOWNLOAD STAGE AGAINST THE LOCAL FAULT-INJECTING MIRROR OF mirror_server.py.
+RUN: python -m pytest -q test_download.py (or python -m unittest test_download)
+'''
+
+# Importing libraries
+import os, tempfile, threading, time, unittest
+from download import Concurrency_Controller, Downloader
+from mirror_server import make_server
+
+YEAR = 2002 # Year served by the mirror, the files are synthetic
+
+class Test_Download(unittest.TestCase): # Class for the tests of download.py
+    def start_mirror(self, **settings):
+        '''
+        Function:- Starts a mirror with small synthetic files on a free port and returns its URL. The mirror is shut down after the test
+        '''
+        server = make_server(port=0, archive_dir=os.devnull, n_stations=20, hours_per_day=1, **settings)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return f'http://127.0.0.1:{server.server_address[1]}/'
+
+    def test_fetch_files_with_faults(self):
+        '''
+        Function:- All selected files are downloaded although 40% of the requests are answered with 429 or 503
+        '''
+        main_url = self.start_mirror(error_rate=0.2, throttle_rate=0.2, retry_after=0)
+        downloader = Downloader(max_retries=30, backoff=0.01, max_backoff=0.05, max_concurrency=4)
+        response, year_url = downloader.fetch_URL(main_url, YEAR)
+        with tempfile.TemporaryDirectory() as directory:
+            indices, csv_links = downloader.select_files(response, YEAR, None, 10, manifest_dir=os.path.join(directory, 'Selections'))
+            failed = downloader.fetch_files(directory, indices, csv_links, year_url, YEAR)
+            self.assertEqual(failed, [])
+            downloaded = sorted(os.listdir(os.path.join(directory, str(YEAR))))
+            self.assertEqual(downloaded, sorted(csv_links[i] for i in indices))
+
+    def test_limit_drops_on_throttling(self):
+        '''
+        Function:- The number of parallel downloads is reduced when the server answers with 429 or 503
+        '''
+        for settings in [{'throttle_rate': 1.0, 'retry_after': 0}, {'error_rate': 1.0}]:
+            main_url = self.start_mirror(**settings)
+            controller = Concurrency_Controller(initial=8, maximum=8)
+            response = Downloader(max_retries=1, backoff=0.01).get_with_retry(main_url + f'{YEAR}/', controller)
+            self.assertIn(response.status_code, (429, 503))
+            self.assertLess(controller.limit, 8)
+
+    def test_retry_after_is_honoured(self):
+        '''
+        Function:- Retry-After is waited in full and the request is retried, even when it is longer than max_backoff
+        '''
+        main_url = self.start_mirror(throttle_rate=1.0, retry_after=1)
+        downloader = Downloader(max_retries=2, backoff=0.01, max_backoff=0.05)
+        start = time.monotonic()
+        response = downloader.get_with_retry(main_url + f'{YEAR}/')
+        self.assertGreaterEqual(time.monotonic() - start, 2.0) # Two retries, each after the full second
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(downloader.retry_delay(response, 0), 1.0)
+        self.assertEqual(Downloader(max_retry_after=0.5).retry_delay(response, 0), 0.5)
+
+
+# MAIN CODE
+if __name__ == '__main__':
+    unittest.main()